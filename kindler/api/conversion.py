@@ -0,0 +1,90 @@
+import logging
+import os
+import shutil
+
+from flask import render_template, Blueprint, redirect, url_for, send_file
+
+from kindler import artifact_cache, conversion
+from kindler.conversion import ConversionQueueFull
+
+conversion_bp = Blueprint("conversion", __name__, url_prefix="/conversion")
+
+MIME_TYPES = {
+    "epub": "application/epub+zip",
+    "mobi": "application/x-mobipocket-ebook",
+    "azw3": "application/vnd.amazon.ebook",
+}
+
+
+@conversion_bp.route("/<job_id>")
+def status(job_id):
+    job = conversion.get_job(job_id)
+    if not job or "status" not in job:
+        return expired()
+    if job["status"] == conversion.FAILED:
+        return redirect(url_for("error.error", status_code=500))
+    if not is_complete(job):
+        return expired()
+    return render_template(
+        "conversion_status.html",
+        job_id=job_id,
+        title=job["title"],
+        save_format=job["format"],
+        done=job["status"] == conversion.DONE,
+    )
+
+
+@conversion_bp.route("/<job_id>/download")
+def download(job_id):
+    job = conversion.get_job(job_id)
+    if not job or not is_complete(job) or "artifact" not in job:
+        return expired()
+    # Evicted from the artifact cache since it was converted
+    artifact = artifact_cache.get(job["artifact"])
+    if not artifact:
+        return expired()
+    return send_artifact(artifact)
+
+
+def is_complete(job):
+    # Hashes written around their expiry may have lost the fields set at submit
+    return all(key in job for key in ("status", "title", "format"))
+
+
+def expired():
+    return redirect(url_for("error.error", status_code=410))
+
+
+def save_book(
+    html_content, title, save_format, options, url, work_dir=None, alias=False
+):
+    """Send a book converted before, or queue it and redirect to its status page.
+
+    With alias, url is aliased to the book's artifact.
+    """
+    alias_url = url if alias else None
+    artifact = conversion.find(html_content, title, save_format, options, alias_url)
+    if artifact:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return send_artifact(artifact)
+    try:
+        job_id = conversion.submit(
+            html_content, title, save_format, options, work_dir, url=alias_url
+        )
+    except ConversionQueueFull as e:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        logging.warning(f"Refusing to convert {url}: {e}")
+        return redirect(url_for("error.error", status_code=503, url=url))
+    return redirect(url_for("conversion.status", job_id=job_id))
+
+
+def send_artifact(artifact):
+    extension = os.path.splitext(artifact["filename"])[1].lstrip(".")
+    return send_file(
+        artifact["file"],
+        mimetype=MIME_TYPES.get(extension),
+        as_attachment=True,
+        download_name=artifact["filename"],
+    )
@@ -1,4 +1,8 @@
-from flask import render_template, Blueprint, request
+import logging
+
+from flask import render_template, Blueprint, request, redirect, url_for
+
+from kindler.util import PageTooLargeError
 
 error_bp = Blueprint("error", __name__, url_prefix="/error")
 
@@ -20,7 +24,24 @@ def map_status_code_to_error(status_code):
             return "Website denied access (403)"
         case "404":
             return "Page not found (404)"
+        case "410":
+            return "This book has expired, please save it again (410)"
+        case "413":
+            return "Page is too large to render (413)"
         case "500":
             return "Encountered internal error (500)"
+        case "503":
+            return "Too many books are being prepared, try again shortly (503)"
         case _:
             return None
+
+
+def fetch_error_redirect(url, error):
+    if isinstance(error, PageTooLargeError):
+        logging.warning(f"Refusing to render {url}: {error}")
+        return redirect(url_for("error.error", status_code=413, url=url))
+    logging.warning(f"Network error fetching URL: {error}")
+    status_code = 500
+    if hasattr(error, "response") and error.response is not None:
+        status_code = getattr(error.response, "status_code", 500)
+    return redirect(url_for("error.error", status_code=status_code, url=url))
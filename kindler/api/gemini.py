@@ -1,17 +1,18 @@
 import logging
-import os
-import socket
-import ssl
-import subprocess
-import sys
-import tempfile
-from urllib.parse import urljoin, urlparse, quote
-
-from bs4 import BeautifulSoup
-from flask import render_template, Blueprint, request, Response, send_file, abort
+
+from flask import render_template, stream_template, Blueprint, request, Response
+from flask import abort, redirect, url_for
 from pathvalidate import sanitize_filename
 
-from kindler.gemini_converter import gemtext_to_html
+from kindler import compression, gemini_cache, gemini_client, gemini_prefetch
+from kindler.api.conversion import save_book
+from kindler.gemini_client import GeminiError
+from kindler.gemini_converter import (
+    gemtext_to_html,
+    gemtext_title,
+    iter_gemtext_html,
+    search_result_urls,
+)
 
 gemini_bp = Blueprint("gemini", __name__, url_prefix="/gemini")
 
@@ -32,11 +33,14 @@ def search():
         logging.warning("Search query is empty.")
         return "Please provide a search query.", 400
     response = get_gemini_content(f"{SEARCH_URL}/search?{query}")
-    html_content = gemtext_to_html(response["content"], is_search=True)["content"]
+    if not response or response["content"] is None:
+        return redirect(url_for("error.error", status_code=500))
+    prefetch_search_results(response)
+    html_content = gemtext_to_html(
+        response["content"], is_search=True, base_url=SEARCH_URL, query=query
+    )
     return render_template(
-        "result_gemini.html",
-        query=query,
-        content=clean_gemini_html(html_content, SEARCH_URL, query),
+        "result_gemini.html", query=query, content=html_content["content"]
     )
 
 
@@ -49,15 +53,23 @@ def readability_page():
         return "Please provide a URL to clean.", 400
     is_search_page = "gemini://tlgs.one/search" in url
     response = get_gemini_content(url)
-    html_content = gemtext_to_html(response["content"], is_search_page)
-    return render_template(
+    if not response or response["content"] is None:
+        return redirect(url_for("error.error", status_code=500, url=url))
+    if is_search_page:
+        prefetch_search_results(response)
+    # Chunks are converted (and sent, compressed) while the template renders
+    page = stream_template(
         "read_gemini.html",
-        title=html_content["title"],
-        content=clean_gemini_html(html_content["content"], url, query),
+        title=gemtext_title(response["content"]),
+        content=iter_gemtext_html(
+            response["content"], is_search_page, response["url"], query
+        ),
         url=url,
         query=query,
         is_search_page=is_search_page,
     )
+    source = f"{url}\n{response['url']}\n{query}\n{response['content']}"
+    return compression.compress_stream(page, source.encode("utf-8"))
 
 
 @gemini_bp.route("/save_page")
@@ -70,11 +82,14 @@ def save_page():
     if save_format not in allowed_formats:
         abort(400, "Invalid format")
 
-    article = gemtext_to_html(get_gemini_content(url)["content"])
+    response = get_gemini_content(url)
+    if not response or response["content"] is None:
+        return redirect(url_for("error.error", status_code=500, url=url))
+    article = gemtext_to_html(response["content"], base_url=url, query=query)
     html_content = render_template(
         "read_save_formatted.html",
         title=article["title"],
-        content=clean_gemini_html(article["content"], url, query),
+        content=article["content"],
         url=url,
     )
     if "html" == save_format:
@@ -83,115 +98,33 @@ def save_page():
             f"attachment; filename={sanitize_filename(article['title'] + '.html')}"
         )
         return response
-    else:
-        with tempfile.NamedTemporaryFile(
-            suffix=".html", delete=False, mode="w", encoding="utf-8"
-        ) as html_tmp:
-            html_tmp.write(html_content)
-            input_html_file = html_tmp.name
-        with tempfile.NamedTemporaryFile(
-            suffix=f".{save_format}", delete=False
-        ) as output_tmp:
-            output_file = output_tmp.name
-        try:
-            subprocess.run(
-                [
-                    "ebook-convert",
-                    input_html_file,
-                    output_file,
-                    "--title",
-                    article["title"],
-                    "--chapter",
-                    "//h1",
-                    "--level1-toc",
-                    "//h1",
-                ],
-                check=True,
-            )
-            download_file_name = sanitize_filename(f"{article['title']}.{save_format}")
-            response = send_file(
-                output_file, as_attachment=True, download_name=download_file_name
-            )
-
-            @response.call_on_close
-            def cleanup():
-                for f in [input_html_file, output_file]:
-                    try:
-                        os.remove(f)
-                        logging.info(f"File {f} deleted")
-                    except OSError:
-                        pass
-
-            return response
-        except subprocess.CalledProcessError as e:
-            os.remove(input_html_file)
-            if os.path.exists(output_file):
-                os.remove(output_file)
-            abort(500, f"Conversion failed: {e}")
+    return save_book(
+        html_content,
+        article["title"],
+        save_format,
+        ["--chapter", "//h1", "--level1-toc", "//h1"],
+        url,
+    )
 
 
 def get_gemini_content(url):
-    parsed_url = urlparse(url)
-    hostname = parsed_url.hostname
-    path = parsed_url.path or "/"
+    return gemini_cache.get_content(url, fetch_gemini_content)
 
-    port = parsed_url.port or 1965
 
-    context = ssl.create_default_context()
-    context.check_hostname = False
-    context.verify_mode = ssl.CERT_NONE
+def prefetch_search_results(response):
+    # The next page and the top results are the likely next clicks
+    gemini_prefetch.prefetch(
+        search_result_urls(
+            response["content"],
+            response["url"],
+            gemini_prefetch.GEMINI_PREFETCH_LINKS,
+        )
+    )
+
 
+def fetch_gemini_content(url):
     try:
-        with socket.create_connection((hostname, port)) as sock:
-            with context.wrap_socket(sock, server_hostname=hostname) as ssock:
-                request = (url + "\r\n").encode("utf-8")
-                ssock.sendall(request)
-
-                response_header = b""
-                while not response_header.endswith(b"\r\n"):
-                    response_header += ssock.recv(1)
-
-                status_meta = response_header.decode("utf-8").strip()
-                status, meta = status_meta.split(" ", 1)
-                status = int(status)
-
-                content = None
-                if status == 20:
-                    all_content = b""
-                    while True:
-                        content_bytes = ssock.recv(4096)
-                        if not content_bytes:
-                            break
-                        all_content += content_bytes
-                    content = all_content.decode("utf-8")
-                return {"status": status, "meta": meta, "content": content}
-    except Exception as e:
-        print(f"An error occurred: {e}", file=sys.stderr)
+        return gemini_client.get(url)
+    except (GeminiError, OSError, ValueError) as e:
+        logging.warning(f"Failed to fetch {url}: {e}")
         return None
-
-
-def clean_gemini_html(html_content, base_url, query, is_search=False):
-    soup = BeautifulSoup(html_content, "html.parser")
-    for link in soup.find_all("a", href=True):
-        href = link["href"]
-        if href.startswith("#"):
-            link.decompose()
-            continue
-        absolute_url = urljoin(base_url, href)
-        scheme = urlparse(absolute_url).scheme
-        if scheme == "gemini":
-            encoded = quote(absolute_url, safe="")
-            link["href"] = f"/gemini/readability?q={query}&url={encoded}"
-        elif scheme in ("http", "https"):
-            encoded = quote(absolute_url, safe="")
-            link["href"] = f"/readability?q={query}&url={encoded}"
-        elif absolute_url.startswith("/"):
-            link["href"] = (
-                f"/gemini/readability?q={query}&url=gemini://{urlparse(base_url).netloc}{absolute_url}"
-            )
-        elif scheme == "mailto":
-            pass
-        else:
-            pass
-
-    return str(soup)
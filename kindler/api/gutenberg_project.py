@@ -2,6 +2,8 @@ import requests
 import logging
 from flask import render_template, Blueprint, request
 
+from kindler import http_client
+
 gutenberg_bp = Blueprint("gutenberg", __name__, url_prefix="/gutenberg")
 
 third_party_gutendex_base_url = "https://gutendex.com/books/"
@@ -32,7 +34,7 @@ def readability_page():
 
 def search_book_from_gutendex_api(query):
     try:
-        response = requests.get(
+        response = http_client.get(
             self_hosted_gutendex_base_url, params={"search": query}, timeout=5
         )
         logging.info(f"Successfully called self-hosted Gutendex for: '{query}' keyword")
@@ -41,14 +43,16 @@ def search_book_from_gutendex_api(query):
         logging.info(
             f"Failed to call self-hosted Gutendex for: '{query}' keyword. Trying third-party now"
         )
-        return requests.get(
+        return http_client.get(
             third_party_gutendex_base_url, params={"search": query}, timeout=5
         )
 
 
 def retrieve_book_details_by_id_from_gutendex_api(book_id):
     try:
-        response = requests.get(f"{self_hosted_gutendex_base_url}{book_id}", timeout=5)
+        response = http_client.get(
+            f"{self_hosted_gutendex_base_url}{book_id}", timeout=5
+        )
         logging.info(
             f"Successfully called self-hosted Gutendex to retrieve book details of book_id: '{book_id}'"
         )
@@ -57,4 +61,4 @@ def retrieve_book_details_by_id_from_gutendex_api(book_id):
         logging.info(
             f"Failed to call self-hosted Gutendex to retrieve book details of book_id: '{book_id}'. Trying third-party now"
         )
-        return requests.get(f"{third_party_gutendex_base_url}{book_id}", timeout=5)
+        return http_client.get(f"{third_party_gutendex_base_url}{book_id}", timeout=5)
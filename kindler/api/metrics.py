@@ -0,0 +1,10 @@
+from flask import Blueprint, jsonify
+
+from kindler import metrics
+
+metrics_bp = Blueprint("metrics", __name__, url_prefix="/metrics")
+
+
+@metrics_bp.route("")
+def get_metrics():
+    return jsonify(metrics.get_all())
@@ -1,6 +1,7 @@
-import requests
 from flask import render_template, Blueprint, request
 
+from kindler import http_client
+
 standard_ebooks_bp = Blueprint(
     "standard_ebooks", __name__, url_prefix="/standard_ebooks"
 )
@@ -32,12 +33,12 @@ def readability_page():
 
 
 def search_book_from_metasearch_api(query):
-    response = requests.get(
+    response = http_client.get(
         f"{metasearch_url}/search", params={"q": query, "provider": provider}, timeout=5
     )
     return response
 
 
 def retrieve_book_details_by_id_from_metasearch_api(book_id):
-    response = requests.get(f"{metasearch_url}/{book_id}", timeout=5)
+    response = http_client.get(f"{metasearch_url}/{book_id}", timeout=5)
     return response
@@ -1,32 +1,63 @@
 import logging
-import os
-import subprocess
-import tempfile
 from urllib.parse import urljoin, urlparse, quote
 
 import requests
 from bs4 import BeautifulSoup
 from ddgs import DDGS
 from flask import render_template, Blueprint, request, Response, redirect, url_for
-from flask import send_file, abort
+from flask import abort
 from pathvalidate import sanitize_filename
 from readabilipy import simple_json_from_html_string
 from readability import Document
 
-from kindler.util import is_blob_content
+from kindler.api.conversion import save_book
+from kindler.api.error import fetch_error_redirect
+from kindler.article_cache import get_article
+from kindler.readability_pool import pool as readability_pool
+from kindler.readability_pool import ReadabilityPoolError, ReadabilityPoolUnavailable
 
 web_bp = Blueprint("web", __name__, url_prefix="/web")
 
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36",
-    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-    "Accept-Language": "en-US,en;q=0.5",
-    "Referer": "https://www.google.com/",
-    "DNT": "1",
-}
-
 allowed_formats = {"html", "epub", "mobi", "azw3"}
 
+ALLOWED_TAGS = {
+    "p",
+    "a",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "pre",
+    "br",
+    "sup",
+    "sub",
+    "strong",
+    "em",
+    "ul",
+    "ol",
+    "li",
+}
+ALLOWED_ATTRS = {"a": ("href", "id", "name"), "sup": ("id",)}
+DROPPED_TAGS = {
+    "img",
+    "picture",
+    "source",
+    "figure",
+    "script",
+    "style",
+    "iframe",
+    "form",
+    "button",
+    "noscript",
+    "svg",
+    "video",
+    "audio",
+}
+# Removed when they end up without any text
+EMPTY_DROPPED_TAGS = {"p", "li", "ul"}
+
 
 @web_bp.route("/")
 def home():
@@ -52,13 +83,22 @@ def readability_page():
         logging.warning("Readability URL is empty.")
         return redirect(url_for("error.error", status_code=400, url=url))
     try:
-        is_blob, req = is_blob_content(url)
-        if is_blob:
-            return redirect(url)
         if alternative_renderer:
-            article = get_js_readability_result(req.text, url, query)
+            is_blob, article = get_article(
+                url,
+                "js",
+                query,
+                lambda text: get_js_readability_result(text, url, query),
+            )
         else:
-            article = get_python_readability_result(req.text, url, query)
+            is_blob, article = get_article(
+                url,
+                "python",
+                query,
+                lambda text: get_python_readability_result(text, url, query),
+            )
+        if is_blob:
+            return redirect(url)
         return render_template(
             "read_web.html",
             title=article["title"],
@@ -68,11 +108,7 @@ def readability_page():
         )
 
     except requests.exceptions.RequestException as e:
-        logging.warning(f"Network error fetching URL: {e}")
-        status_code = 500
-        if hasattr(e, "response") and e.response is not None:
-            status_code = getattr(e.response, "status_code", 500)
-        return redirect(url_for("error.error", status_code=status_code, url=url))
+        return fetch_error_redirect(url, e)
     except Exception as e:
         logging.error(f"An error occurred during readability processing: {e}")
         return f"An error occurred during processing: {e}", 500
@@ -88,8 +124,18 @@ def save_page():
     if save_format not in allowed_formats:
         abort(400, "Invalid format")
 
-    req = requests.get(url, headers=HEADERS, timeout=10)
-    article = get_python_readability_result(req.text, url, query)
+    try:
+        # Same article as the default readability view, usually still cached
+        is_blob, article = get_article(
+            url,
+            "python",
+            query,
+            lambda text: get_python_readability_result(text, url, query),
+        )
+    except requests.exceptions.RequestException as e:
+        return fetch_error_redirect(url, e)
+    if is_blob:
+        return redirect(url)
     html_content = render_template(
         "read_save_formatted.html",
         title=article["title"],
@@ -102,53 +148,13 @@ def save_page():
             f"attachment; filename={sanitize_filename(article['title'] + '.html')}"
         )
         return response
-    else:
-        with tempfile.NamedTemporaryFile(
-            suffix=".html", delete=False, mode="w", encoding="utf-8"
-        ) as html_tmp:
-            html_tmp.write(html_content)
-            input_html_file = html_tmp.name
-        with tempfile.NamedTemporaryFile(
-            suffix=f".{save_format}", delete=False
-        ) as output_tmp:
-            output_file = output_tmp.name
-        try:
-            subprocess.run(
-                [
-                    "ebook-convert",
-                    input_html_file,
-                    output_file,
-                    "--title",
-                    article["title"],
-                    "--chapter",
-                    "//h2",
-                    "--level1-toc",
-                    "//h2",
-                    "--chapter-mark",
-                    "pagebreak",
-                ],
-                check=True,
-            )
-            download_file_name = sanitize_filename(f"{article['title']}.{save_format}")
-            response = send_file(
-                output_file, as_attachment=True, download_name=download_file_name
-            )
-
-            @response.call_on_close
-            def cleanup():
-                for f in [input_html_file, output_file]:
-                    try:
-                        os.remove(f)
-                        logging.info(f"File {f} deleted")
-                    except OSError:
-                        pass
-
-            return response
-        except subprocess.CalledProcessError as e:
-            os.remove(input_html_file)
-            if os.path.exists(output_file):
-                os.remove(output_file)
-            abort(500, f"Conversion failed: {e}")
+    return save_book(
+        html_content,
+        article["title"],
+        save_format,
+        ["--chapter", "//h2", "--level1-toc", "//h2", "--chapter-mark", "pagebreak"],
+        url,
+    )
 
 
 def get_python_readability_result(html_content, base_url, query):
@@ -160,130 +166,75 @@ def get_python_readability_result(html_content, base_url, query):
 
 
 def get_js_readability_result(html_content, base_url, query):
-    article = simple_json_from_html_string(html_content, use_readability=True)
+    try:
+        article = readability_pool.parse(html_content)
+    except ReadabilityPoolUnavailable as e:
+        logging.info(f"Readability.js pool unavailable, running it directly: {e}")
+        article = simple_json_from_html_string(html_content, use_readability=True)
+    except ReadabilityPoolError as e:
+        logging.warning(f"Falling back to the Python renderer: {e}")
+        return get_python_readability_result(html_content, base_url, query)
     return {
-        "content": clean_readability_html(article["content"], base_url, query),
-        "title": article["title"],
+        "content": clean_readability_html(article["content"] or "", base_url, query),
+        "title": article["title"] or None,
     }
 
 
 def clean_readability_html(html_content, base_url, query, only_links_rewrite=False):
     soup = BeautifulSoup(html_content, "html.parser")
-
-    rewrite_links(soup, base_url, query)
-    remove_images(soup)
-    if only_links_rewrite:
-        return "\n".join(
-            line.strip() for line in str(soup).splitlines() if line.strip()
-        )
-
-    # --- Drop navigation/menus explicitly ---
-    for nav in soup.find_all("nav"):
-        nav.decompose()
-    for div in soup.find_all("div", class_=lambda c: c and "nav" in c.lower()):
-        div.decompose()
-    for ul in soup.find_all(
-        "ul", class_=lambda c: c and ("menu" in c.lower() or "nav" in c.lower())
-    ):
-        ul.decompose()
-    for ol in soup.find_all(
-        "ol", class_=lambda c: c and ("menu" in c.lower() or "nav" in c.lower())
-    ):
-        ol.decompose()
-
-    # --- Strip attributes (keep only essential ones) ---
-    for tag in soup.find_all(True):
-        allowed_attrs = {"a": ["href", "id", "name"], "sup": ["id"]}
-        tag.attrs = {
-            k: v for k, v in tag.attrs.items() if k in allowed_attrs.get(tag.name, [])
-        }
-
-    # --- Whitelist allowed tags ---
-    allowed_tags = [
-        "p",
-        "a",
-        "h1",
-        "h2",
-        "h3",
-        "h4",
-        "h5",
-        "h6",
-        "pre",
-        "br",
-        "sup",
-        "sub",
-        "strong",
-        "em",
-        "ul",
-        "ol",
-        "li",
-    ]
-    for tag in soup.find_all(True):
-        if tag.name not in allowed_tags:
-            tag.unwrap()
-
-    # --- Remove empty paragraphs ---
-    for p in soup.find_all("p"):
-        if not p.get_text(strip=True):
-            p.decompose()
-
-    # Find all <ul> and <li> tags in the document.
-    empty_tags_to_remove = []
-
-    # Iterate over all <li> tags.
-    for li_tag in soup.find_all("li"):
-        # Check if the tag's text content, after stripping whitespace, is empty.
-        if not li_tag.text.strip():
-            empty_tags_to_remove.append(li_tag)
-
-    # Iterate over all <ul> tags.
-    for ul_tag in soup.find_all("ul"):
-        # Check if the tag's text content, after stripping whitespace, is empty.
-        # This will also catch <ul> tags that only contained empty <li> tags.
-        if not ul_tag.text.strip():
-            empty_tags_to_remove.append(ul_tag)
-
-    # Decompose the tags outside the loop to avoid modifying the list being iterated over.
-    for tag in empty_tags_to_remove:
-        tag.decompose()
-
-    # --- Return cleaned HTML ---
-    return "\n".join(line.strip() for line in str(soup).splitlines() if line.strip())
-
-
-def rewrite_links(soup, base_url, query):
-    # --- Rewrite links to go through /web/readability ---
     readability_endpoint = f"/web/readability?q={query}&url="
-    for link in soup.find_all("a", href=True):
-        href = link["href"]
-        if href.startswith("#"):
-            # Remove back-to-top style anchors
-            link.decompose()
+    # One walk over the tags, in reverse document order so a tag is handled
+    # after everything inside it: whether a p/li/ul is left empty is then
+    # known. Tags inside a dropped one are handled for nothing, but that's
+    # cheaper than a separate pass per rule.
+    for tag in reversed(soup.find_all(True)):
+        if is_dropped(tag, only_links_rewrite):
+            tag.decompose()
             continue
-        absolute_url = urljoin(base_url, href)
-        if urlparse(absolute_url).scheme not in ("http", "https"):
+        if tag.name == "a" and tag.has_attr("href"):
+            tag["href"] = rewrite_link(tag["href"], base_url, readability_endpoint)
+        if only_links_rewrite:
             continue
-        encoded = quote(absolute_url, safe="")
-        link["href"] = f"{readability_endpoint}{encoded}"
+        allowed_attrs = ALLOWED_ATTRS.get(tag.name, ())
+        tag.attrs = {k: v for k, v in tag.attrs.items() if k in allowed_attrs}
+        if tag.name not in ALLOWED_TAGS:
+            # Serialized without its own start and end tags, like the soup
+            # itself. Tag.unwrap() costs a list search per moved child.
+            tag.hidden = True
+        elif tag.name in EMPTY_DROPPED_TAGS and not tag.get_text(strip=True):
+            tag.decompose()
+    return "\n".join(line.strip() for line in str(soup).splitlines() if line.strip())
 
 
-def remove_images(soup):
-    # --- Remove unhelpful tags (media, scripts, forms, etc.) ---
-    for tag in soup.find_all(
-        [
-            "img",
-            "picture",
-            "source",
-            "figure",
-            "script",
-            "style",
-            "iframe",
-            "form",
-            "button",
-            "noscript",
-            "svg",
-            "video",
-            "audio",
-        ]
-    ):
-        tag.decompose()
+def is_dropped(tag, only_links_rewrite):
+    # Back-to-top style anchors
+    if tag.name == "a" and str(tag.get("href", "")).startswith("#"):
+        return True
+    # Media, scripts, forms, etc.
+    if tag.name in DROPPED_TAGS:
+        return True
+    if only_links_rewrite:
+        return False
+    # Navigation/menus
+    if tag.name == "nav":
+        return True
+    if tag.name == "div":
+        return has_class_containing(tag, ("nav",))
+    if tag.name in ("ul", "ol"):
+        return has_class_containing(tag, ("menu", "nav"))
+    return False
+
+
+def has_class_containing(tag, keywords):
+    classes = tag.get("class") or []
+    if isinstance(classes, str):
+        classes = [classes]
+    return any(keyword in c.lower() for c in classes for keyword in keywords)
+
+
+def rewrite_link(href, base_url, readability_endpoint):
+    # Route links through /web/readability
+    absolute_url = urljoin(base_url, href)
+    if urlparse(absolute_url).scheme not in ("http", "https"):
+        return href
+    return f"{readability_endpoint}{quote(absolute_url, safe='')}"
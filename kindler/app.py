@@ -4,14 +4,17 @@ from flask import Flask, redirect, url_for
 from flask_healthz import healthz
 from logging.config import dictConfig
 
+from kindler.api.conversion import conversion_bp
 from kindler.api.error import error_bp
 from kindler.api.gemini import gemini_bp
 from kindler.api.gutenberg_au_project import gutenberg_au_bp
 from kindler.api.gutenberg_project import gutenberg_bp
 from kindler.api.home import home_bp
+from kindler.api.metrics import metrics_bp
 from kindler.api.news import news_bp
 from kindler.api.standard_ebooks import standard_ebooks_bp
 from kindler.api.web import web_bp
+from kindler import compression
 from kindler.cache import cache, CACHE_CONFIG
 
 
@@ -53,6 +56,7 @@ app.config.update(CACHE_CONFIG)
 app.config.update(HEALTHZ={"live": liveness, "ready": readiness})
 
 cache.init_app(app)
+compression.init_app(app)
 
 app.register_blueprint(web_bp)
 app.register_blueprint(gemini_bp)
@@ -62,6 +66,8 @@ app.register_blueprint(gutenberg_au_bp)
 app.register_blueprint(standard_ebooks_bp)
 app.register_blueprint(home_bp)
 app.register_blueprint(error_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(conversion_bp)
 app.register_blueprint(healthz, url_prefix="/healthz")
 
 
@@ -0,0 +1,68 @@
+import hashlib
+import logging
+import os
+import time
+
+from kindler import document_store, metrics
+from kindler.cache import cache_get, cache_set
+from kindler.util import is_blob_content, normalize_url
+
+# How long a cached article is served without asking the upstream
+ARTICLE_CACHE_TTL = int(os.getenv("ARTICLE_CACHE_TTL", str(60 * 60)))
+# How long it is kept around for conditional revalidation after that
+ARTICLE_CACHE_MAX_AGE = int(os.getenv("ARTICLE_CACHE_MAX_AGE", str(7 * 24 * 60 * 60)))
+
+
+def get_article(url, renderer, query, build_article):
+    key = article_cache_key(url, renderer, query)
+    entry = cache_get(key)
+    if entry and entry["fresh_until"] > time.time():
+        metrics.incr("article_cache.hit")
+        return False, entry["article"]
+
+    if entry:
+        is_blob, page = is_blob_content(url, conditional_headers(entry))
+        if not is_blob and page["status"] != 304:
+            document_store.put_page(url, page)
+    else:
+        # The page may have just been fetched for another renderer or a download
+        is_blob, page = document_store.get_page(url)
+    if is_blob:
+        return True, None
+    if entry and page["status"] == 304:
+        logging.info(f"Revalidated cached article for {url}")
+        metrics.incr("article_cache.revalidated")
+        entry["fresh_until"] = time.time() + ARTICLE_CACHE_TTL
+        entry["etag"] = page["etag"] or entry["etag"]
+        entry["last_modified"] = page["last_modified"] or entry["last_modified"]
+        cache_set(key, entry, ARTICLE_CACHE_MAX_AGE)
+        return False, entry["article"]
+
+    metrics.incr("article_cache.miss")
+    article = build_article(page["text"])
+    cache_set(
+        key,
+        {
+            "article": article,
+            "etag": page["etag"],
+            "last_modified": page["last_modified"],
+            "fresh_until": time.time() + ARTICLE_CACHE_TTL,
+        },
+        ARTICLE_CACHE_MAX_AGE,
+    )
+    return False, article
+
+
+def article_cache_key(url, renderer, query):
+    # Rewritten links carry the search query, so it's part of the key
+    digest = hashlib.sha1(f"{normalize_url(url)}\n{query or ''}".encode("utf-8"))
+    return f"article:{renderer}:{digest.hexdigest()}"
+
+
+def conditional_headers(entry):
+    headers = {}
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
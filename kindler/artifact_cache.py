@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import redis
+
+from kindler import metrics
+from kindler.cache import redis_client
+from kindler.util import normalize_url
+
+ARTIFACT_CACHE_DIR = os.getenv(
+    "ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "kindler-artifacts")
+)
+ARTIFACT_CACHE_MAX_SIZE = int(
+    os.getenv("ARTIFACT_CACHE_MAX_SIZE", str(1024 * 1024 * 1024))
+)
+# How long a book URL keeps pointing at its last converted artifact
+ARTIFACT_ALIAS_TTL = int(os.getenv("ARTIFACT_ALIAS_TTL", str(24 * 3600)))
+# Replicas share one index, and ARTIFACT_CACHE_DIR (e.g. over NFS). Only
+# replicas with a directory of their own need a scope each.
+ARTIFACT_CACHE_SCOPE = os.getenv("ARTIFACT_CACHE_SCOPE", "shared")
+
+INDEX_KEY = f"artifact:{ARTIFACT_CACHE_SCOPE}:lru"
+SIZE_KEY = f"artifact:{ARTIFACT_CACHE_SCOPE}:size"
+META_KEY = f"artifact:{ARTIFACT_CACHE_SCOPE}:meta:"
+ALIAS_KEY = f"artifact:{ARTIFACT_CACHE_SCOPE}:alias:"
+# ebook-convert options whose value names a file
+FILE_OPTIONS = {"--cover"}
+
+
+def digest(html_content, save_format, options):
+    """Content address of a conversion: the HTML, the format and the options.
+
+    Values of FILE_OPTIONS (such as --cover) are hashed by the file contents,
+    since the file lives in a per-request scratch directory.
+    """
+    sha = hashlib.sha256()
+    sha.update(save_format.encode("utf-8") + b"\0")
+    sha.update(html_content.encode("utf-8") + b"\0")
+    for i, option in enumerate(options):
+        if i and options[i - 1] in FILE_OPTIONS:
+            sha.update(file_digest(option))
+        else:
+            sha.update(str(option).encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def file_digest(path):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).digest()
+    except OSError:
+        # e.g. a cover that failed to download, ebook-convert will do without
+        return str(path).encode("utf-8")
+
+
+def artifact_path(key):
+    return os.path.join(ARTIFACT_CACHE_DIR, key[:2], key)
+
+
+def get(key):
+    """Return {key, file, filename} for a cached artifact, bumping it in the LRU.
+
+    The artifact is returned open, so it can still be read if it's evicted
+    before the caller gets to it. The caller closes the file.
+    """
+    try:
+        meta = redis_client.hgetall(META_KEY + key)
+        if not meta:
+            metrics.incr("artifact_cache.miss")
+            return None
+        artifact = open(artifact_path(key), "rb")
+    except FileNotFoundError:
+        # Evicted since it was looked up
+        metrics.incr("artifact_cache.miss")
+        return None
+    except redis.RedisError as e:
+        logging.warning(f"Artifact cache unavailable: {e}")
+        return None
+    try:
+        redis_client.zadd(INDEX_KEY, {key: time.time()})
+    except redis.RedisError as e:
+        logging.warning(f"Failed to bump artifact {key}: {e}")
+    metrics.incr("artifact_cache.hit")
+    return {
+        "key": key,
+        "file": artifact,
+        "filename": meta[b"filename"].decode("utf-8"),
+    }
+
+
+def put(key, source_file, filename):
+    """Copy a converted file into the cache and index it, returning success."""
+    path = artifact_path(key)
+    try:
+        tmp_path = _tmp_path(path)
+        shutil.copyfile(source_file, tmp_path)
+        return _index(key, tmp_path, path, filename)
+    except OSError as e:
+        logging.warning(f"Failed to cache artifact {key}: {e}")
+        return False
+
+
+def put_content(key, content, filename):
+    path = artifact_path(key)
+    try:
+        tmp_path = _tmp_path(path)
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        return _index(key, tmp_path, path, filename)
+    except OSError as e:
+        logging.warning(f"Failed to cache artifact {key}: {e}")
+        return False
+
+
+def _tmp_path(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique across the replicas writing to a shared directory
+    return f"{path}.{uuid.uuid4().hex}.tmp"
+
+
+def _index(key, tmp_path, path, filename):
+    os.replace(tmp_path, path)
+    size = os.path.getsize(path)
+    try:
+        if redis_client.hsetnx(META_KEY + key, "size", size):
+            redis_client.incrby(SIZE_KEY, size)
+        redis_client.hset(META_KEY + key, "filename", filename)
+        redis_client.zadd(INDEX_KEY, {key: time.time()})
+        evict()
+    except redis.RedisError as e:
+        logging.warning(f"Failed to index artifact {key}: {e}")
+        return False
+    return True
+
+
+def evict():
+    while int(redis_client.get(SIZE_KEY) or 0) > ARTIFACT_CACHE_MAX_SIZE:
+        oldest = redis_client.zpopmin(INDEX_KEY)
+        if not oldest:
+            break
+        key = oldest[0][0].decode("utf-8")
+        size = redis_client.hget(META_KEY + key, "size")
+        redis_client.delete(META_KEY + key)
+        redis_client.decrby(SIZE_KEY, int(size or 0))
+        try:
+            os.remove(artifact_path(key))
+        except OSError:
+            pass
+        metrics.incr("artifact_cache.evicted")
+        logging.info(f"Evicted artifact {key}")
+
+
+def alias_key(url, save_format):
+    url_hash = hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()
+    return f"{ALIAS_KEY}{save_format}:{url_hash}"
+
+
+def get_alias(url, save_format):
+    """Return the cached artifact last produced for a URL, skipping the fetch."""
+    try:
+        key = redis_client.get(alias_key(url, save_format))
+    except redis.RedisError as e:
+        logging.warning(f"Artifact cache unavailable: {e}")
+        return None
+    return get(key.decode("utf-8")) if key else None
+
+
+def set_alias(url, save_format, key):
+    try:
+        redis_client.set(alias_key(url, save_format), key, ex=ARTIFACT_ALIAS_TTL)
+    except redis.RedisError as e:
+        logging.warning(f"Failed to alias artifact {key}: {e}")
@@ -1,5 +1,7 @@
+import logging
 import os
 
+import redis
 from flask_caching import Cache
 
 cache = Cache()
@@ -7,3 +9,32 @@ cache = Cache()
 REDIS_URL = os.getenv("REDIS_URL", "redis://:secret@localhost:17285/0")
 
 CACHE_CONFIG = {"CACHE_TYPE": "RedisCache", "CACHE_REDIS_URL": REDIS_URL}
+
+# Raw client for counters and data structures flask-caching doesn't cover
+redis_client = redis.Redis.from_url(REDIS_URL)
+
+
+def cache_get(key):
+    """cache.get(), None when Redis can't be reached, like a miss."""
+    try:
+        return cache.get(key)
+    except redis.RedisError as e:
+        logging.warning(f"Failed to read {key} from the cache: {e}")
+        return None
+
+
+def cache_set(key, value, timeout):
+    """cache.set(), logging instead of failing when Redis can't be reached."""
+    try:
+        cache.set(key, value, timeout=timeout)
+    except redis.RedisError as e:
+        logging.warning(f"Failed to write {key} to the cache: {e}")
+
+
+def cache_has(key):
+    """cache.has(), False when Redis can't be reached, like a miss."""
+    try:
+        return cache.has(key)
+    except redis.RedisError as e:
+        logging.warning(f"Failed to look up {key} in the cache: {e}")
+        return False
@@ -0,0 +1,204 @@
+import functools
+import gzip
+import hashlib
+import os
+import re
+import zlib
+
+import brotli
+from flask import current_app, request
+
+from kindler import metrics
+
+COMPRESSIBLE_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+}
+# Not worth the CPU (or the extra header) below this size
+MIN_COMPRESS_SIZE = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+# Streamed bodies are flushed to the client after about this many bytes
+STREAM_FLUSH_SIZE = 8 * 1024
+
+# Whitespace-only runs spanning lines render the same as a single newline,
+# except inside elements where whitespace is significant
+PRESERVED_BLOCK_RE = re.compile(
+    r"(<(pre|textarea|script|style)\b.*?</\2\s*>)", re.IGNORECASE | re.DOTALL
+)
+BLANK_RUN_RE = re.compile(r"[ \t\r]*\n\s*")
+
+_static_versions = {}
+_templates_version = None
+
+
+def init_app(app):
+    app.url_defaults(fingerprint_static)
+    app.after_request(compress_response)
+
+
+def fingerprint_static(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        values.setdefault("v", static_version(values["filename"]))
+
+
+def static_version(filename):
+    # Static files only change on deploy, so hash each one once per worker
+    if filename not in _static_versions:
+        path = os.path.join(current_app.static_folder, filename)
+        try:
+            with open(path, "rb") as f:
+                _static_versions[filename] = hashlib.sha1(f.read()).hexdigest()[:12]
+        except OSError:
+            _static_versions[filename] = None
+    return _static_versions[filename]
+
+
+def templates_version():
+    # Templates also only change on deploy, hash them all once per worker
+    global _templates_version
+    if _templates_version is None:
+        sha = hashlib.sha1()
+        folder = os.path.join(current_app.root_path, current_app.template_folder)
+        for root, dirs, names in os.walk(folder):
+            dirs.sort()
+            for name in sorted(names):
+                with open(os.path.join(root, name), "rb") as f:
+                    sha.update(f.read())
+        _templates_version = sha.digest()
+    return _templates_version
+
+
+def minify_html(html):
+    parts = PRESERVED_BLOCK_RE.split(html)
+    # split() yields text, block, tag name, text, block, tag name, ...
+    for i in range(0, len(parts), 3):
+        parts[i] = BLANK_RUN_RE.sub("\n", parts[i])
+    return "".join(part for i, part in enumerate(parts) if i % 3 != 2)
+
+
+def choose_encoding(accept_encodings):
+    if accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response):
+    if request.endpoint == "static" and request.args.get("v"):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    if (
+        response.status_code != 200
+        # Generated streams go through compress_stream(), files (direct
+        # passthrough) are bounded
+        or (response.is_streamed and not response.direct_passthrough)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.direct_passthrough = False
+    body = response.get_data()
+    if response.mimetype == "text/html" and response.mimetype_params.get(
+        "charset", "utf-8"
+    ).lower() in ("utf-8", "utf8"):
+        body = minify_html(body.decode("utf-8", "surrogateescape")).encode(
+            "utf-8", "surrogateescape"
+        )
+    # Even bodies too small to compress: caches must not serve them to
+    # clients of another encoding once they've grown
+    response.vary.add("Accept-Encoding")
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        encoding = choose_encoding(request.accept_encodings)
+
+    # Strong validator of the rendered body, per representation
+    etag = hashlib.sha1(body).hexdigest()
+    response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    response.set_data(body)
+    response.make_conditional(request)
+    if response.status_code == 304:
+        metrics.incr("http.not_modified")
+        count_bytes(0, len(body))
+        return response
+
+    if encoding:
+        response.set_data(compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+    count_bytes(response.content_length, len(body))
+    return response
+
+
+def compress_stream(chunks, source, mimetype="text/html"):
+    """Response streaming chunks, compressed while they're generated.
+
+    The body is only known once it has been sent, so the ETag is computed
+    from source, what the body is rendered from, and the templates.
+    """
+    encoding = choose_encoding(request.accept_encodings)
+    etag = hashlib.sha1(source + templates_version()).hexdigest()
+    etag = f"{etag}-{encoding}" if encoding else etag
+    response = current_app.response_class(mimetype=mimetype)
+    response.vary.add("Accept-Encoding")
+    response.set_etag(etag)
+    # Not make_conditional(), which would buffer the stream for its length
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        metrics.incr("http.not_modified")
+        count_bytes(0, 0)
+        return response
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.response = compress_chunks(chunks, encoding, request.endpoint or "unknown")
+    return response
+
+
+def compress_chunks(chunks, encoding, route):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        write, flush, finish = compressor.process, compressor.flush, compressor.finish
+    elif encoding:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        write, finish = compressor.compress, compressor.flush
+        flush = functools.partial(compressor.flush, zlib.Z_SYNC_FLUSH)
+    sent = rendered = pending = 0
+    for chunk in chunks:
+        data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        rendered += len(data)
+        if encoding:
+            # Flushing every small template chunk would hurt the ratio
+            pending += len(data)
+            data = write(data)
+            if pending >= STREAM_FLUSH_SIZE:
+                data += flush()
+                pending = 0
+        if data:
+            sent += len(data)
+            yield data
+    if encoding:
+        data = finish()
+        sent += len(data)
+        yield data
+    count_bytes(sent, rendered, route)
+
+
+def count_bytes(sent, rendered, route=None):
+    # Batched, rather than two Redis round trips on every response
+    route = route or request.endpoint or "unknown"
+    metrics.batch.incr(f"http.bytes_sent.{route}", sent)
+    metrics.batch.incr(f"http.bytes_rendered.{route}", rendered)
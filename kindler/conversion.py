@@ -0,0 +1,264 @@
+import contextlib
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+import redis
+from pathvalidate import sanitize_filename
+
+from kindler import artifact_cache, metrics
+from kindler.cache import redis_client
+
+# Conversions allowed to run at the same time on this node, across all gunicorn workers
+CONVERSION_WORKERS = int(os.getenv("CONVERSION_WORKERS", "2"))
+CONVERSION_TIMEOUT = int(os.getenv("CONVERSION_TIMEOUT", "300"))
+# Seconds a conversion slot is held without a heartbeat from its worker,
+# after which the job it was running is queued again
+CONVERSION_LEASE_TTL = int(os.getenv("CONVERSION_LEASE_TTL", "30"))
+CONVERSION_MAX_QUEUE = int(os.getenv("CONVERSION_MAX_QUEUE", "20"))
+# How long job status is kept, for the book to be downloaded
+CONVERSION_RESULT_TTL = int(os.getenv("CONVERSION_RESULT_TTL", "900"))
+CONVERSION_DIR = os.getenv(
+    "CONVERSION_DIR", os.path.join(tempfile.gettempdir(), "kindler-conversions")
+)
+
+# Input files live on local disk, so jobs are consumed by the node that created them
+NODE = socket.gethostname()
+QUEUE_KEY = f"conversion:queue:{NODE}"
+SLOT_KEY = f"conversion:slot:{NODE}"
+# The job taken by each slot, until it's done
+RUNNING_KEY = f"conversion:running:{NODE}"
+JOB_KEY = "conversion:job:"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class ConversionQueueFull(Exception):
+    pass
+
+
+def create_work_dir():
+    work_dir = os.path.join(CONVERSION_DIR, uuid.uuid4().hex)
+    os.makedirs(work_dir, exist_ok=True)
+    return work_dir
+
+
+def find(html_content, title, save_format, options, url=None):
+    """Return the artifact of a conversion already done, open, or None.
+
+    When url is given, it is aliased to the artifact.
+    """
+    artifact_key = artifact_cache.digest(
+        html_content, save_format, job_options(title, options)
+    )
+    artifact = artifact_cache.get(artifact_key)
+    if artifact and url:
+        artifact_cache.set_alias(url, save_format, artifact_key)
+    return artifact
+
+
+def submit(html_content, title, save_format, options, work_dir=None, url=None):
+    """Queue an ebook-convert run and return the job id to poll.
+
+    When url is given, it is aliased to the resulting artifact.
+    """
+    job_id = uuid.uuid4().hex
+    options = job_options(title, options)
+    artifact_key = artifact_cache.digest(html_content, save_format, options)
+    if redis_client.llen(QUEUE_KEY) >= CONVERSION_MAX_QUEUE:
+        metrics.incr("conversion.rejected")
+        raise ConversionQueueFull(f"{CONVERSION_MAX_QUEUE} conversions already queued")
+    work_dir = work_dir or create_work_dir()
+    input_file = os.path.join(work_dir, "page.html")
+    with open(input_file, "w", encoding="utf-8") as f:
+        f.write(html_content)
+    job = {
+        "id": job_id,
+        "work_dir": work_dir,
+        "input": input_file,
+        "output": os.path.join(work_dir, f"book.{save_format}"),
+        "format": save_format,
+        "options": options,
+        "artifact": artifact_key,
+        "title": title,
+        "filename": sanitize_filename(f"{title}.{save_format}"),
+        "url": url,
+    }
+    pipe = redis_client.pipeline()
+    pipe.hset(
+        JOB_KEY + job_id,
+        mapping={"status": QUEUED, "title": title, "format": save_format},
+    )
+    pipe.expire(JOB_KEY + job_id, CONVERSION_RESULT_TTL)
+    pipe.rpush(QUEUE_KEY, json.dumps(job))
+    pipe.execute()
+    metrics.incr("conversion.submitted")
+    consumer.ensure_started()
+    return job_id
+
+
+def job_options(title, options):
+    return ["--title", title, *options]
+
+
+def get_job(job_id):
+    consumer.ensure_started()
+    job = redis_client.hgetall(JOB_KEY + job_id)
+    if not job:
+        return None
+    return {key.decode("utf-8"): value.decode("utf-8") for key, value in job.items()}
+
+
+def update_job(job_id, mapping):
+    pipe = redis_client.pipeline()
+    pipe.hset(JOB_KEY + job_id, mapping=mapping)
+    pipe.expire(JOB_KEY + job_id, CONVERSION_RESULT_TTL)
+    pipe.execute()
+
+
+def convert(input_file, output_file, options, timeout=CONVERSION_TIMEOUT):
+    subprocess.run(
+        ["ebook-convert", input_file, output_file, *options],
+        check=True,
+        timeout=timeout,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def run_job(job):
+    started = time.monotonic()
+    try:
+        # Queued jobs can outlive the status set at submit, so it's written
+        # whole again, with a fresh expiry, to cover the conversion and download
+        update_job(
+            job["id"],
+            {"status": RUNNING, "title": job["title"], "format": job["format"]},
+        )
+        convert(job["input"], job["output"], job["options"])
+        # The book is downloaded from the artifact cache, Redis only keeps
+        # its key
+        if not artifact_cache.put(job["artifact"], job["output"], job["filename"]):
+            raise OSError("Failed to keep the converted book")
+        if job["url"]:
+            artifact_cache.set_alias(job["url"], job["format"], job["artifact"])
+        update_job(job["id"], {"status": DONE, "artifact": job["artifact"]})
+        metrics.incr("conversion.completed")
+        logging.info(
+            f"Converted job {job['id']} in {time.monotonic() - started:.1f}s "
+            f"({os.path.getsize(job['output'])} bytes)"
+        )
+    except Exception as e:
+        logging.error(f"Conversion of job {job['id']} failed: {e}")
+        update_job(job["id"], {"status": FAILED, "error": str(e)})
+        metrics.incr("conversion.failed")
+    finally:
+        shutil.rmtree(job["work_dir"], ignore_errors=True)
+
+
+class ConversionConsumer:
+    """Runs queued jobs, holding one of the node's conversion slots per job.
+
+    Every gunicorn worker runs CONVERSION_WORKERS consumer threads, but a job
+    is only taken off the queue once a slot is free, so at most
+    CONVERSION_WORKERS conversions run on the node. A slot is a lease kept
+    alive by a heartbeat while its job runs: if the worker dies (or gunicorn
+    recycles it) mid-job, the slot expires, and whoever takes it next puts
+    the job back at the head of the queue.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def ensure_started(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            for i in range(CONVERSION_WORKERS):
+                threading.Thread(
+                    target=self.run, name=f"conversion-consumer-{i}", daemon=True
+                ).start()
+
+    def run(self):
+        while True:
+            try:
+                slot = self.acquire_slot()
+                running_key = f"{RUNNING_KEY}:{slot_index(slot)}"
+                try:
+                    item = redis_client.blmove(
+                        QUEUE_KEY, running_key, 5, "LEFT", "RIGHT"
+                    )
+                    if item:
+                        try:
+                            with heartbeat(slot):
+                                run_job(json.loads(item))
+                        finally:
+                            redis_client.delete(running_key)
+                finally:
+                    redis_client.delete(slot)
+            except redis.RedisError as e:
+                logging.warning(f"Conversion consumer lost Redis: {e}")
+                time.sleep(5)
+            except Exception as e:
+                # A broken job must not stop the consumer
+                logging.error(f"Conversion consumer dropped a job: {e}")
+
+    def acquire_slot(self):
+        while True:
+            for i in range(CONVERSION_WORKERS):
+                slot = f"{SLOT_KEY}:{i}"
+                if redis_client.set(
+                    slot, os.getpid(), nx=True, ex=CONVERSION_LEASE_TTL
+                ):
+                    requeue_abandoned(i)
+                    return slot
+            time.sleep(0.5)
+
+
+def slot_index(slot):
+    return slot.rsplit(":", 1)[1]
+
+
+def requeue_abandoned(index):
+    # A job left running under a free slot lost its worker
+    running_key = f"{RUNNING_KEY}:{index}"
+    while item := redis_client.lmove(running_key, QUEUE_KEY, "RIGHT", "LEFT"):
+        job = json.loads(item)
+        update_job(job["id"], {"status": QUEUED})
+        metrics.incr("conversion.requeued")
+        logging.warning(f"Requeued conversion job {job['id']}, its worker is gone")
+
+
+@contextlib.contextmanager
+def heartbeat(slot):
+    """Keep the slot's lease alive while the block runs."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(CONVERSION_LEASE_TTL / 3):
+            try:
+                redis_client.expire(slot, CONVERSION_LEASE_TTL)
+            except redis.RedisError as e:
+                logging.warning(f"Failed to renew conversion slot {slot}: {e}")
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{slot}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+consumer = ConversionConsumer()
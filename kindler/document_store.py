@@ -0,0 +1,82 @@
+import contextlib
+import hashlib
+import logging
+import os
+
+from kindler import metrics
+from kindler.cache import cache_get, cache_set
+from kindler.util import is_blob_content, normalize_url, stream_page_text, MAX_PAGE_SIZE
+
+# Fetched pages are kept just long enough to be saved or converted after viewing
+DOCUMENT_STORE_TTL = int(os.getenv("DOCUMENT_STORE_TTL", str(15 * 60)))
+# Larger pages and articles (e.g. whole books) are fetched again rather than
+# pickled into Redis
+DOCUMENT_STORE_MAX_SIZE = int(os.getenv("DOCUMENT_STORE_MAX_SIZE", str(1024 * 1024)))
+
+
+def get_page(url, max_size=MAX_PAGE_SIZE):
+    """Return (is_blob, page) from the store, fetching and storing it on a miss."""
+    page = cache_get(document_key("page", url))
+    if page is not None:
+        metrics.incr("document_store.hit")
+        return False, page
+    metrics.incr("document_store.miss")
+    is_blob, page = is_blob_content(url, max_size=max_size)
+    if is_blob:
+        return True, None
+    put_page(url, page)
+    return False, page
+
+
+@contextlib.contextmanager
+def open_page_text(url, max_size=MAX_PAGE_SIZE):
+    """Yield (is_blob, chunks) of the page's text, the stored one if any.
+
+    A page that isn't stored is streamed and not stored, for pages too large
+    to be held whole.
+    """
+    page = cache_get(document_key("page", url))
+    if page is not None:
+        metrics.incr("document_store.hit")
+        yield False, [page["text"]]
+        return
+    metrics.incr("document_store.miss")
+    with stream_page_text(url, max_size) as (is_blob, chunks):
+        yield is_blob, chunks
+
+
+def put_page(url, page):
+    if is_storable(url, page["text"]):
+        cache_set(document_key("page", url), page, DOCUMENT_STORE_TTL)
+
+
+def get_document_article(url, name, build_article, max_size=MAX_PAGE_SIZE):
+    """Return (is_blob, article), extracting it from the stored page on a miss.
+
+    name identifies how the article was built (renderer, query, ...).
+    """
+    key = document_key("article", url, name)
+    article = cache_get(key)
+    if article is not None:
+        metrics.incr("document_store.hit")
+        return False, article
+    is_blob, page = get_page(url, max_size)
+    if is_blob:
+        return True, None
+    article = build_article(page["text"])
+    if is_storable(url, article["content"]):
+        cache_set(key, article, DOCUMENT_STORE_TTL)
+    return False, article
+
+
+def is_storable(url, text):
+    if len(text) <= DOCUMENT_STORE_MAX_SIZE:
+        return True
+    logging.info(f"Not storing {url}, {len(text)} characters is too large")
+    metrics.incr("document_store.too_large")
+    return False
+
+
+def document_key(kind, url, name=""):
+    digest = hashlib.sha1(f"{normalize_url(url)}\n{name}".encode("utf-8"))
+    return f"document:{kind}:{digest.hexdigest()}"
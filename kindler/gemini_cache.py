@@ -0,0 +1,69 @@
+import hashlib
+import logging
+import os
+from urllib.parse import urlparse
+
+from kindler import metrics
+from kindler.cache import cache_get, cache_has, cache_set
+
+GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", str(60 * 60)))
+# Search results change, but users page back and forth through them
+GEMINI_SEARCH_CACHE_TTL = int(os.getenv("GEMINI_SEARCH_CACHE_TTL", str(5 * 60)))
+GEMINI_SEARCH_PREFIX = "gemini://tlgs.one/search"
+
+
+def parse_host_ttls(value):
+    # "host=seconds,host=seconds", 0 disables caching for a host
+    ttls = {}
+    for item in value.split(","):
+        host, _, ttl = item.strip().partition("=")
+        if not host:
+            continue
+        try:
+            ttls[host.lower()] = int(ttl)
+        except ValueError:
+            logging.warning(f"Ignoring invalid gemini cache TTL for {host}: {ttl}")
+    return ttls
+
+
+GEMINI_CACHE_HOST_TTLS = parse_host_ttls(os.getenv("GEMINI_CACHE_HOST_TTLS", ""))
+
+
+def get_content(url, fetch):
+    """Return fetch(url), serving successful responses from Redis when cached."""
+    ttl = cache_ttl(url)
+    if ttl <= 0:
+        return fetch(url)
+    key = gemini_cache_key(url)
+    response = cache_get(key)
+    if response is not None:
+        metrics.incr("gemini_cache.hit")
+        return response
+    metrics.incr("gemini_cache.miss")
+    response = fetch(url)
+    if response:
+        put(url, response)
+    return response
+
+
+def is_cached(url):
+    return cache_ttl(url) > 0 and cache_has(gemini_cache_key(url))
+
+
+def put(url, response):
+    ttl = cache_ttl(url)
+    if ttl > 0 and response["status"] == 20:
+        cache_set(gemini_cache_key(url), response, ttl)
+
+
+def cache_ttl(url):
+    host = (urlparse(url).hostname or "").lower()
+    if host in GEMINI_CACHE_HOST_TTLS:
+        return GEMINI_CACHE_HOST_TTLS[host]
+    if url.startswith(GEMINI_SEARCH_PREFIX):
+        return GEMINI_SEARCH_CACHE_TTL
+    return GEMINI_CACHE_TTL
+
+
+def gemini_cache_key(url):
+    return f"gemini:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
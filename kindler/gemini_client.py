@@ -0,0 +1,202 @@
+import asyncio
+import codecs
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import urljoin, urlparse
+
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "5"))
+# Budget for the whole response, so a capsule dribbling bytes can't hold a worker
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "15"))
+GEMINI_MAX_SIZE = int(os.getenv("GEMINI_MAX_SIZE", str(5 * 1024 * 1024)))
+GEMINI_MAX_REDIRECTS = int(os.getenv("GEMINI_MAX_REDIRECTS", "5"))
+DEFAULT_PORT = 1965
+# <STATUS><SPACE><META><CR><LF>, META is at most 1024 bytes
+MAX_HEADER_SIZE = 1029
+CHUNK_SIZE = 64 * 1024
+MAX_SESSIONS = 256
+
+# Capsules mostly use self-signed certificates (TOFU), so none are verified
+_context = ssl.create_default_context()
+_context.check_hostname = False
+_context.verify_mode = ssl.CERT_NONE
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class GeminiError(Exception):
+    pass
+
+
+def get(url, max_redirects=GEMINI_MAX_REDIRECTS):
+    """Fetch a gemini URL, following redirects.
+
+    Returns {"status", "meta", "content", "url"}; content is only set for
+    successful (2x) responses.
+    """
+    for _ in range(max_redirects + 1):
+        response = request(url)
+        if response["status"] // 10 != 3:
+            return response
+        url = redirect_url(url, response["meta"])
+        logging.info(f"Following gemini redirect to {url}")
+    raise GeminiError(f"Too many redirects, last one to {url}")
+
+
+def request(url):
+    parsed_url = urlparse(url)
+    hostname = parsed_url.hostname
+    port = parsed_url.port or DEFAULT_PORT
+    try:
+        return _request(url, hostname, port, time.monotonic() + GEMINI_TIMEOUT)
+    except TimeoutError as e:
+        raise GeminiError(f"Gemini request to {hostname} timed out") from e
+
+
+def _request(url, hostname, port, deadline):
+    with socket.create_connection(
+        (hostname, port), timeout=GEMINI_CONNECT_TIMEOUT
+    ) as sock:
+        with _context.wrap_socket(
+            sock, server_hostname=hostname, session=_get_session(hostname, port)
+        ) as ssock:
+            ssock.sendall((url + "\r\n").encode("utf-8"))
+            stream = ssock.makefile("rb")
+            _set_timeout(ssock, deadline)
+            status, meta = parse_header(stream.readline(MAX_HEADER_SIZE + 1), hostname)
+
+            content = None
+            if status // 10 == 2:
+                body = bytearray()
+                while True:
+                    _set_timeout(ssock, deadline)
+                    chunk = stream.read1(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    body += chunk
+                    if len(body) > GEMINI_MAX_SIZE:
+                        raise GeminiError(
+                            f"Response is larger than {GEMINI_MAX_SIZE} bytes"
+                        )
+                content = body.decode(charset(meta), errors="replace")
+            _save_session(hostname, port, ssock)
+            return {"status": status, "meta": meta, "content": content, "url": url}
+
+
+async def get_async(url, max_redirects=GEMINI_MAX_REDIRECTS, throttle=None):
+    """Same as get(), from an event loop.
+
+    throttle, when given, is awaited with the size of every chunk read.
+    """
+    for _ in range(max_redirects + 1):
+        response = await request_async(url, throttle)
+        if response["status"] // 10 != 3:
+            return response
+        url = redirect_url(url, response["meta"])
+    raise GeminiError(f"Too many redirects, last one to {url}")
+
+
+async def request_async(url, throttle=None):
+    parsed_url = urlparse(url)
+    hostname = parsed_url.hostname
+    port = parsed_url.port or DEFAULT_PORT
+    try:
+        async with asyncio.timeout(GEMINI_TIMEOUT):
+            return await _request_async(url, hostname, port, throttle)
+    except TimeoutError as e:
+        raise GeminiError(f"Gemini request to {hostname} timed out") from e
+
+
+async def _request_async(url, hostname, port, throttle):
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(hostname, port, ssl=_context, server_hostname=hostname),
+        GEMINI_CONNECT_TIMEOUT,
+    )
+    try:
+        writer.write((url + "\r\n").encode("utf-8"))
+        await writer.drain()
+        try:
+            header = await reader.readuntil(b"\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            raise GeminiError(f"Malformed response header from {hostname}") from e
+        status, meta = parse_header(header, hostname)
+
+        content = None
+        if status // 10 == 2:
+            body = bytearray()
+            while chunk := await reader.read(CHUNK_SIZE):
+                body += chunk
+                if len(body) > GEMINI_MAX_SIZE:
+                    raise GeminiError(
+                        f"Response is larger than {GEMINI_MAX_SIZE} bytes"
+                    )
+                if throttle:
+                    await throttle(len(chunk))
+            content = body.decode(charset(meta), errors="replace")
+        return {"status": status, "meta": meta, "content": content, "url": url}
+    finally:
+        writer.close()
+
+
+def resolve(base_url, url):
+    """urljoin() that also resolves relative URLs against gemini:// URLs.
+
+    urllib only resolves them for the schemes it knows, so the base URL is
+    joined as http:// and the result given its gemini:// scheme back.
+    """
+    if urlparse(url).scheme or urlparse(base_url).scheme != "gemini":
+        return urljoin(base_url, url)
+    joined = urljoin("http" + base_url[len("gemini") :], url)
+    return "gemini" + joined[len("http") :]
+
+
+def redirect_url(url, location):
+    target = resolve(url, location)
+    # A capsule must not send the client off to http:// or file:// URLs
+    if urlparse(target).scheme != "gemini":
+        raise GeminiError(f"Refusing redirect to {target}")
+    return target
+
+
+def parse_header(header, hostname):
+    if len(header) > MAX_HEADER_SIZE or not header.endswith(b"\r\n"):
+        raise GeminiError(f"Malformed response header from {hostname}")
+    status, _, meta = header.decode("utf-8").strip().partition(" ")
+    return int(status), meta
+
+
+def charset(meta):
+    for param in meta.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "charset" and value:
+            try:
+                return codecs.lookup(value.strip("\"'")).name
+            except LookupError:
+                break
+    return "utf-8"
+
+
+def _set_timeout(ssock, deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise GeminiError("Gemini response timed out")
+    ssock.settimeout(remaining)
+
+
+def _get_session(hostname, port):
+    with _sessions_lock:
+        return _sessions.get((hostname, port))
+
+
+def _save_session(hostname, port, ssock):
+    # Resuming skips the full handshake on the next request to the capsule
+    if ssock.session is not None:
+        with _sessions_lock:
+            _sessions.pop((hostname, port), None)
+            if len(_sessions) >= MAX_SESSIONS:
+                del _sessions[next(iter(_sessions))]
+            _sessions[(hostname, port)] = ssock.session
@@ -1,6 +1,23 @@
 import html
 import re
-from html import escape
+from urllib.parse import urlparse, quote
+
+from kindler.gemini_client import resolve
+
+# Same line boundaries as str.splitlines()
+LINE_BREAK_RE = re.compile(r"\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+NEXT_PAGE_RE = re.compile(r"=> /search/\d+\?.*?➡️ Next Page")
+PREVIOUS_PAGE_RE = re.compile(r"=> /search(?:/\d+)?\?.*?⬅️ Previous Page")
+SEARCH_PAGE_CLUTTER = (
+    "=> / 🏠 Home",
+    "=> /search 🔍 Search",
+    "=> /backlinks? 🔙 Query backlinks",
+    "## Search",
+    "📚 Enter verbose search",
+    "↗️ Go to page",
+)
+# Lines are batched into chunks of about this size when streaming
+CHUNK_SIZE = 8 * 1024
 
 
 def escape(text: str) -> str:
@@ -8,121 +25,170 @@ def escape(text: str) -> str:
     return html.escape(text)
 
 
-def gemtext_to_html(gemtext: str, is_search=False) -> dict:
+def gemtext_to_html(gemtext: str, is_search=False, base_url=None, query=None) -> dict:
     """
     Converts a Gemtext string into a dictionary containing HTML content and a title.
 
-    This enhanced version correctly handles code blocks, links, and blockquotes,
-    providing a more robust conversion.
-
     Args:
         gemtext: The input Gemtext content as a string.
+        base_url: When given, links are rewritten to go through the app.
 
     Returns:
         A dictionary with "title" and "content" keys, where content is an
         HTML string.
     """
-    html_lines = []
+    return {
+        "title": gemtext_title(gemtext),
+        "content": "".join(iter_gemtext_html(gemtext, is_search, base_url, query)),
+    }
+
+
+def gemtext_title(gemtext: str):
+    """Returns the text of the first top level heading, without converting."""
+    in_code_block = False
+    for line in iter_lines(gemtext):
+        if line.startswith("```"):
+            in_code_block = not in_code_block
+        elif not in_code_block and line.startswith("# "):
+            return line[2:]
+    return None
+
+
+def iter_gemtext_html(gemtext: str, is_search=False, base_url=None, query=None):
+    """
+    Converts Gemtext to HTML, yielding chunks as the document is read.
+
+    Handles code blocks, lists, links and blockquotes. When base_url is given,
+    gemini and web links are rewritten to the readability views while
+    converting, so the HTML never has to be parsed again.
+    """
+    buffer = []
+    size = 0
+    separator = ""
+    for piece in iter_html_lines(gemtext, is_search, base_url, query):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield separator + "\n".join(buffer)
+            separator = "\n"
+            buffer = []
+            size = 0
+    if buffer:
+        yield separator + "\n".join(buffer)
+
+
+def iter_html_lines(gemtext, is_search, base_url, query):
     in_list = False
     in_code_block = False
-    title = None
-    next_page_pattern = r"=> /search/\d+\?.*?➡️ Next Page"
-    previous_page_patten = r"=> /search(?:/\d+)?\?.*?⬅️ Previous Page"
     next_page_href = None
     previous_page_href = None
-    lines = gemtext.splitlines()
-    for i, line in enumerate(lines):
+    for line in iter_lines(gemtext):
         if is_search:
             if is_search_page_clutter(line):
                 continue
-            if re.search(next_page_pattern, line) and not next_page_href:
-                href, _ = convert_to_href(line)
+            if not next_page_href and NEXT_PAGE_RE.search(line):
+                href = rewrite_href(convert_to_href(line)[0], base_url, query)
                 next_page_href = f'<a href="{href}">{escape("Next Page")}</a>'
                 continue
-            if re.search(previous_page_patten, line) and not previous_page_href:
-                href, _ = convert_to_href(line)
+            if not previous_page_href and PREVIOUS_PAGE_RE.search(line):
+                href = rewrite_href(convert_to_href(line)[0], base_url, query)
                 previous_page_href = f'<a href="{href}" style="margin-right: 3em;">{escape("Previous Page")}</a>'
                 continue
 
         # Handle code blocks
         if line.startswith("```"):
             if not in_code_block:
-                html_lines.append("<code><pre>")
+                yield "<code><pre>"
                 in_code_block = True
             else:
-                html_lines.append("</pre></code>")
+                yield "</pre></code>"
                 in_code_block = False
             continue
 
         if in_code_block:
-            html_lines.append(escape(line))
+            yield escape(line)
             continue
 
         # Handle lists
         if line.startswith("* "):
             if not in_list:
-                html_lines.append("<ul>")
+                yield "<ul>"
                 in_list = True
-            html_lines.append(f"<li>{escape(line[2:])}</li>")
+            yield f"<li>{escape(line[2:])}</li>"
             continue
         elif in_list:
-            html_lines.append("</ul>")
+            yield "</ul>"
             in_list = False
 
         # Handle headings
         if line.startswith("### "):
-            html_lines.append(f"<h3>{escape(line[4:])}</h3>")
+            yield f"<h3>{escape(line[4:])}</h3>"
         elif line.startswith("## "):
-            html_lines.append(f"<h2>{escape(line[3:])}</h2>")
+            yield f"<h2>{escape(line[3:])}</h2>"
         elif line.startswith("# "):
-            heading_text = line[2:]
-            if title is None:
-                title = heading_text
             if not is_search:
-                html_lines.append(f"<h1>{escape(heading_text)}</h1>")
+                yield f"<h1>{escape(line[2:])}</h1>"
         # Handle links
         elif line.startswith("=>"):
             href, link_text = convert_to_href(line)
-            html_lines.append(f'<p><a href="{href}">{escape(link_text)}</a></p>')
+            if base_url is not None and href.startswith("#"):
+                # Fragment links have no meaning once converted
+                yield "<p></p>"
+                continue
+            href = rewrite_href(href, base_url, query)
+            yield f'<p><a href="{href}">{escape(link_text)}</a></p>'
         # Handle blockquotes
         elif line.startswith(">"):
-            html_lines.append(f"<blockquote>{escape(line[1:].strip())}</blockquote>")
+            yield f"<blockquote>{escape(line[1:].strip())}</blockquote>"
         # Handle regular paragraphs
         else:
             if line:
-                html_lines.append(f"<p>{escape(line)}</p>")
+                yield f"<p>{escape(line)}</p>"
             if is_search:
-                html_lines.append("<hr />")
+                yield "<hr />"
 
     # Close any open list or code block at the end of the file
     if in_list:
-        html_lines.append("</ul>")
+        yield "</ul>"
     if in_code_block:
-        html_lines.append("</code></pre>")
+        yield "</code></pre>"
 
     if is_search:
         if previous_page_href and next_page_href:
-            html_lines.append(
-                f'<p style="text-align: center;">{previous_page_href}{next_page_href}</p>'
-            )
+            yield f'<p style="text-align: center;">{previous_page_href}{next_page_href}</p>'
         elif next_page_href:
-            html_lines.append(f'<p style="text-align: center;">{next_page_href}</p>')
-    return {"title": title, "content": "\n".join(html_lines)}
+            yield f'<p style="text-align: center;">{next_page_href}</p>'
+
+
+def iter_lines(text):
+    start = 0
+    for match in LINE_BREAK_RE.finditer(text):
+        yield text[start : match.start()]
+        start = match.end()
+    if start < len(text):
+        yield text[start:]
+
+
+def rewrite_href(href, base_url, query):
+    if base_url is None:
+        return href
+    absolute_url = resolve(base_url, href)
+    scheme = urlparse(absolute_url).scheme
+    if scheme == "gemini":
+        href = f"/gemini/readability?q={query}&url={quote(absolute_url, safe='')}"
+    elif scheme in ("http", "https"):
+        href = f"/readability?q={query}&url={quote(absolute_url, safe='')}"
+    elif absolute_url.startswith("/"):
+        href = f"/gemini/readability?q={query}&url=gemini://{urlparse(base_url).netloc}{absolute_url}"
+    return html.escape(href)
 
 
 def is_search_page_clutter(gemini_line):
-    if (
+    return (
         not gemini_line
-        or "=> / 🏠 Home" in gemini_line
-        or "=> /search 🔍 Search" in gemini_line
-        or "=> /backlinks? 🔙 Query backlinks" in gemini_line
-        or "## Search" in gemini_line
-        or "📚 Enter verbose search" in gemini_line
+        or any(marker in gemini_line for marker in SEARCH_PAGE_CLUTTER)
         or gemini_line.startswith("* gemini://")
-        or "↗️ Go to page" in gemini_line
-    ):
-        return True
-    return False
+    )
 
 
 def convert_to_href(gemini_line):
@@ -130,3 +196,22 @@ def convert_to_href(gemini_line):
     href = parts[0]
     link_text = parts[1] if len(parts) > 1 else href
     return href, link_text
+
+
+def search_result_urls(gemtext, base_url, limit):
+    """Returns the next page of a search result followed by its first results."""
+    next_page = None
+    results = []
+    search_host = urlparse(base_url).hostname
+    for line in iter_lines(gemtext):
+        if not line.startswith("=>") or is_search_page_clutter(line):
+            continue
+        url = resolve(base_url, convert_to_href(line)[0])
+        if NEXT_PAGE_RE.search(line):
+            next_page = next_page or url
+        elif len(results) < limit and not PREVIOUS_PAGE_RE.search(line):
+            parsed_url = urlparse(url)
+            # Links back into the search engine (backlinks, ...) aren't results
+            if parsed_url.scheme == "gemini" and parsed_url.hostname != search_host:
+                results.append(url)
+    return ([next_page] if next_page else []) + results
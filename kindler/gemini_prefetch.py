@@ -0,0 +1,122 @@
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+from urllib.parse import urlparse
+
+from flask import current_app
+
+from kindler import gemini_cache, gemini_client, metrics
+
+GEMINI_PREFETCH = os.getenv("GEMINI_PREFETCH", "true").lower() == "true"
+# Results of a search page fetched ahead of the user, besides its next page
+GEMINI_PREFETCH_LINKS = int(os.getenv("GEMINI_PREFETCH_LINKS", "3"))
+GEMINI_PREFETCH_HOST_CONCURRENCY = int(
+    os.getenv("GEMINI_PREFETCH_HOST_CONCURRENCY", "2")
+)
+# Bytes per second, shared by all prefetches of a worker process
+GEMINI_PREFETCH_BANDWIDTH = int(os.getenv("GEMINI_PREFETCH_BANDWIDTH", str(512 * 1024)))
+GEMINI_PREFETCH_MAX_PENDING = int(os.getenv("GEMINI_PREFETCH_MAX_PENDING", "32"))
+# Bytes that may be read at once after the bandwidth was left unused
+BANDWIDTH_BURST = 64 * 1024
+
+_loop = None
+_loop_pid = None
+_bandwidth = None
+_pending = set()
+_lock = threading.Lock()
+# Only used from the event loop thread
+_host_limits = {}
+
+
+class Bandwidth:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.available_at = 0.0
+
+    async def consume(self, size):
+        now = asyncio.get_running_loop().time()
+        self.available_at = max(self.available_at, now - self.burst / self.rate)
+        self.available_at += size / self.rate
+        if self.available_at > now:
+            await asyncio.sleep(self.available_at - now)
+
+
+def get_loop():
+    # One event loop thread per worker process, never shared across a fork
+    global _loop, _loop_pid, _bandwidth
+    with _lock:
+        if _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="gemini-prefetch", daemon=True
+            ).start()
+            _loop_pid = os.getpid()
+            _bandwidth = Bandwidth(GEMINI_PREFETCH_BANDWIDTH, BANDWIDTH_BURST)
+            _pending.clear()
+            _host_limits.clear()
+        return _loop
+
+
+def prefetch(urls):
+    """Fetch urls into the gemini cache in the background, skipping cached ones."""
+    if not GEMINI_PREFETCH or not urls:
+        return
+    app = current_app._get_current_object()
+    loop = get_loop()
+    for url in urls:
+        if gemini_cache.cache_ttl(url) <= 0:
+            continue
+        with _lock:
+            if url in _pending or len(_pending) >= GEMINI_PREFETCH_MAX_PENDING:
+                continue
+            _pending.add(url)
+        asyncio.run_coroutine_threadsafe(prefetch_url(app, url), loop)
+
+
+async def prefetch_url(app, url):
+    try:
+        if await asyncio.to_thread(is_cached, app, url):
+            return
+        async with host_limit(urlparse(url).hostname):
+            response = await gemini_client.get_async(url, throttle=_bandwidth.consume)
+        await asyncio.to_thread(store, app, url, response)
+    except Exception as e:
+        logging.info(f"Failed to prefetch {url}: {e}")
+        await asyncio.to_thread(metrics.incr, "gemini_prefetch.failed")
+    finally:
+        with _lock:
+            _pending.discard(url)
+
+
+class HostLimit:
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(GEMINI_PREFETCH_HOST_CONCURRENCY)
+        self.users = 0
+
+
+@contextlib.asynccontextmanager
+async def host_limit(hostname):
+    limit = _host_limits.setdefault(hostname, HostLimit())
+    limit.users += 1
+    try:
+        async with limit.semaphore:
+            yield
+    finally:
+        limit.users -= 1
+        # Forget idle hosts, or the map would grow with every capsule visited
+        if limit.users == 0:
+            del _host_limits[hostname]
+
+
+def is_cached(app, url):
+    with app.app_context():
+        return gemini_cache.is_cached(url)
+
+
+def store(app, url, response):
+    with app.app_context():
+        gemini_cache.put(url, response)
+    metrics.incr("gemini_prefetch.fetched")
@@ -0,0 +1,450 @@
+import html
+import logging
+import os
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from kindler.images import fetch_images
+
+VOID_TAGS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "param",
+    "source",
+    "track",
+    "wbr",
+}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+CENTERED_HEADING_TAGS = {"h1", "h2", "h3", "h4"}
+CENTER_STYLE = "text-align: center;"
+PAGE_BREAK = '<div style="page-break-before: always;"></div>'
+FOOTER_MARKER = "ebook footer include"
+FEED_SIZE = 64 * 1024
+TAG_BOUNDARY = "\x00"
+
+
+class _Element:
+    __slots__ = ("name", "uid", "emitted", "suppress_children", "buffer_index")
+
+    def __init__(self, name, uid, emitted, suppress_children, buffer_index):
+        self.name = name
+        self.uid = uid
+        self.emitted = emitted
+        self.suppress_children = suppress_children
+        # Where the element's content starts in the pre-heading buffer
+        self.buffer_index = buffer_index
+
+
+class _Heading:
+    __slots__ = ("element", "attrs", "pieces", "texts", "is_first", "wrapper")
+
+    def __init__(self, element, attrs, is_first, wrapper):
+        self.element = element
+        self.attrs = attrs
+        self.pieces = []
+        self.texts = []
+        self.is_first = is_first
+        self.wrapper = wrapper
+
+    def text(self):
+        # Same as get_text(strip=True): every string is stripped on its own
+        return "".join(run.strip() for run in "".join(self.texts).split(TAG_BOUNDARY))
+
+
+class _Image:
+    __slots__ = ("attrs", "ancestors")
+
+    def __init__(self, attrs, ancestors):
+        self.attrs = attrs
+        self.ancestors = ancestors
+
+
+class GutenbergAuCleaner(HTMLParser):
+    """
+    Event based cleaner for Project Gutenberg Australia books.
+
+    Applies the cleaning rules while the document is being tokenized, so no
+    DOM is ever built for the book:
+
+    - <style> elements are stripped
+    - everything before the first heading is dropped, except images
+    - h1-h4 and p.author are centered
+    - the book is cut after "THE END" and after the ebook footer comment
+    - image sources are made absolute, or downloaded into img_dir
+    - when building an ebook, <hr> becomes a page break and the heading after
+      the "by ..." heading is demoted to h4
+
+    clean() takes the book's text as a string or as the decoded chunks of its
+    download; with chunks, memory use follows the cleaned output rather than
+    the book. Whitespace between elements that are dropped isn't kept, so the
+    output has fewer blank lines than the BeautifulSoup cleaner it replaced.
+    """
+
+    def __init__(self, base_url, img_dir=None):
+        super().__init__(convert_charrefs=False)
+        self.base_url = base_url
+        self.img_dir = img_dir
+        self.out = []
+        self.compacted = 0
+        self.stack = []
+        self.uid = 0
+        self.title = None
+        self.in_title = False
+        self.cut = False
+        self.hr_seen = False
+        self.the_end_h2_seen = False
+        self.first_heading_seen = False
+        self.by_heading_seen = False
+        self.by_heading_fixed = False
+        # Content between <body> and the first heading is held back until
+        # we know which images survive
+        self.pre_heading = None
+        self.heading = None
+
+    def clean(self, html_content):
+        # Accepts the whole document or an iterable of decoded chunks
+        chunks = html_content
+        if isinstance(html_content, str):
+            chunks = (
+                html_content[i : i + FEED_SIZE]
+                for i in range(0, len(html_content), FEED_SIZE)
+            )
+        for chunk in chunks:
+            self.feed(chunk)
+            self._compact()
+        self.close()
+        return self.render()
+
+    def close(self):
+        super().close()
+        if self.heading:
+            self._flush_heading()
+        if self.pre_heading is not None:
+            self.out.extend(self.pre_heading)
+            self.pre_heading = None
+        while self.stack:
+            element = self.stack.pop()
+            if element.emitted:
+                self.out.append(f"</{element.name}>")
+
+    def render(self):
+        images = [piece for piece in self.out if isinstance(piece, _Image)]
+        downloads = self._download_images(images)
+        cover_image_path = None
+        pieces = []
+        index = 0
+        for piece in self.out:
+            if not isinstance(piece, _Image):
+                pieces.append(piece)
+                continue
+            img, cover_image_path = self._render_image(
+                piece, downloads.get(index), cover_image_path
+            )
+            pieces.append(img)
+            index += 1
+        return "".join(pieces), cover_image_path, self.title
+
+    def _download_images(self, images):
+        # All images of the book are fetched at once, results by image index
+        if not self.img_dir:
+            return {}
+        pending = {}
+        for index, image in enumerate(images):
+            src = dict(image.attrs).get("src")
+            if src:
+                img_url = urljoin(self.base_url, src)
+                ext = os.path.splitext(img_url)[1] or ".jpg"
+                pending[index] = (
+                    img_url,
+                    os.path.join(self.img_dir, f"img{index}{ext}"),
+                )
+        results = fetch_images(pending.values())
+        return {
+            index: (img_url, local_path, result)
+            for (index, (img_url, local_path)), result in zip(pending.items(), results)
+        }
+
+    def _compact(self):
+        # Merge the small pieces written since the last chunk, so memory stays
+        # close to the size of the cleaned output
+        merged = []
+        run = []
+        for piece in self.out[self.compacted :]:
+            if isinstance(piece, _Image):
+                if run:
+                    merged.append("".join(run))
+                    run = []
+                merged.append(piece)
+            else:
+                run.append(piece)
+        if run:
+            merged.append("".join(run))
+        self.out[self.compacted :] = merged
+        self.compacted = len(self.out)
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, self.get_starttag_text(), tag in VOID_TAGS)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, self.get_starttag_text(), True)
+
+    def handle_endtag(self, tag):
+        if not any(element.name == tag for element in self.stack):
+            return
+        while self.stack:
+            element = self.stack.pop()
+            self._end(element)
+            if element.name == tag:
+                break
+
+    def handle_data(self, data):
+        self._emit_text(data, data)
+
+    def handle_entityref(self, name):
+        self._emit_text(f"&{name};", html.unescape(f"&{name};"))
+
+    def handle_charref(self, name):
+        self._emit_text(f"&#{name};", html.unescape(f"&#{name};"))
+
+    def handle_comment(self, data):
+        if self._suppressed():
+            return
+        self._target().append(f"<!--{data}-->")
+        if FOOTER_MARKER in data.lower():
+            # Drop whatever follows the footer marker inside its parent
+            if self.stack:
+                self.stack[-1].suppress_children = True
+            else:
+                self.cut = True
+
+    def handle_decl(self, decl):
+        if not self._suppressed():
+            self._target().append(f"<!{decl}>")
+
+    def handle_pi(self, data):
+        if not self._suppressed():
+            self._target().append(f"<?{data}>")
+
+    def unknown_decl(self, data):
+        if not self._suppressed():
+            self._target().append(f"<![{data}]>")
+
+    def _start(self, tag, attrs, start_tag, is_void):
+        suppressed = self._suppressed()
+        if tag == "title":
+            self.in_title = not is_void
+        if tag == "style":
+            suppressed = True
+        elif suppressed:
+            pass
+        elif tag in HEADING_TAGS and not self.heading:
+            self._start_heading(tag, attrs, start_tag, is_void)
+            return
+        elif self.heading and self.heading.is_first and tag in ("big", "span"):
+            # Keep the first heading clean
+            self.heading.texts.append(TAG_BOUNDARY)
+            if not is_void:
+                self._push(tag, False, False)
+            return
+        elif tag == "img":
+            self._target().append(_Image(attrs, self._ancestors()))
+            return
+        elif tag == "hr":
+            if self.pre_heading is None:
+                self.hr_seen = True
+            if self.img_dir:
+                self._target().append(PAGE_BREAK)
+                return
+        elif tag == "p" and "author" in (dict(attrs).get("class") or "").split():
+            start_tag = build_start_tag(tag, with_style(attrs, CENTER_STYLE))
+        if not suppressed:
+            self._target().append(start_tag)
+            if self.heading:
+                self.heading.texts.append(TAG_BOUNDARY)
+        if not is_void:
+            self._push(tag, not suppressed, suppressed)
+        if tag == "body" and not self.first_heading_seen:
+            self.pre_heading = []
+
+    def _start_heading(self, tag, attrs, start_tag, is_void):
+        is_first = False
+        wrapper = None
+        if not self.first_heading_seen and tag in CENTERED_HEADING_TAGS:
+            self.first_heading_seen = True
+            is_first = True
+            wrapper = self._commit_pre_heading()
+        element = self._push(tag, True, False)
+        self.heading = _Heading(element, attrs, is_first, wrapper)
+        if is_void:
+            self.stack.pop()
+            self._flush_heading()
+
+    def _commit_pre_heading(self):
+        buffered, self.pre_heading = self.pre_heading, None
+        if buffered is None:
+            return None
+        parent = self.stack[-1]
+        wrapper = None
+        container = parent
+        if parent.name not in ("body", "html"):
+            # The heading is moved out of its wrapper (e.g. <center>) and the
+            # rest of the wrapper is dropped
+            wrapper = parent
+            wrapper.emitted = False
+            container = self.stack[-2]
+        # Whatever precedes the heading's container is kept as is
+        if container.buffer_index is not None:
+            self.out.extend(buffered[: container.buffer_index])
+            buffered = buffered[container.buffer_index :]
+        # Previous siblings are dropped, except images and p/a holding images
+        for piece in buffered:
+            if isinstance(piece, _Image) and is_sibling_image(piece, container.uid):
+                self.out.append(piece)
+        return wrapper
+
+    def _flush_heading(self):
+        heading, self.heading = self.heading, None
+        if heading.wrapper:
+            heading.wrapper.suppress_children = True
+        name = heading.element.name
+        text = heading.text()
+        if text == "THE END" and (
+            name == "h3" or (name == "h2" and not self.the_end_h2_seen and self.hr_seen)
+        ):
+            self.cut = True
+            return
+        if name == "h2" and text == "THE END":
+            self.the_end_h2_seen = True
+        if self.img_dir and self.pre_heading is None:
+            name = self._fix_by_keyword(name, text)
+        attrs = heading.attrs
+        if heading.element.name in CENTERED_HEADING_TAGS:
+            attrs = with_style(attrs, CENTER_STYLE)
+        target = self._target()
+        target.append(build_start_tag(name, attrs))
+        target.extend(heading.pieces)
+        target.append(f"</{name}>")
+
+    def _fix_by_keyword(self, name, text):
+        if self.by_heading_fixed:
+            return name
+        if self.by_heading_seen:
+            if not text:
+                return name
+            self.by_heading_fixed = True
+            return "h4" if name in ("h1", "h2") else name
+        if "by" in text.lower():
+            self.by_heading_seen = True
+        return name
+
+    def _push(self, tag, emitted, suppress_children):
+        self.uid += 1
+        buffer_index = None
+        if self.pre_heading is not None:
+            buffer_index = len(self.pre_heading)
+        element = _Element(tag, self.uid, emitted, suppress_children, buffer_index)
+        self.stack.append(element)
+        return element
+
+    def _end(self, element):
+        if element.name == "title":
+            self.in_title = False
+        if element.name == "body" and self.pre_heading is not None:
+            # No heading in the whole body, nothing to drop
+            self.out.extend(self.pre_heading)
+            self.pre_heading = None
+        if self.heading and element is self.heading.element:
+            self._flush_heading()
+            return
+        if element.emitted:
+            self._target().append(f"</{element.name}>")
+            if self.heading:
+                self.heading.texts.append(TAG_BOUNDARY)
+
+    def _emit_text(self, raw, text):
+        if self.in_title:
+            self.title = (self.title or "") + text
+        if self._suppressed():
+            return
+        if self.heading:
+            self.heading.texts.append(text)
+        self._target().append(raw)
+
+    def _suppressed(self):
+        if self.cut:
+            return True
+        return bool(self.stack) and self.stack[-1].suppress_children
+
+    def _target(self):
+        if self.heading:
+            return self.heading.pieces
+        if self.pre_heading is not None:
+            return self.pre_heading
+        return self.out
+
+    def _ancestors(self):
+        return [(element.uid, element.name) for element in self.stack]
+
+    def _render_image(self, image, download, cover_image_path):
+        attrs = dict(image.attrs)
+        src = attrs.get("src")
+        if not src:
+            return build_start_tag("img", image.attrs), cover_image_path
+        if not self.img_dir:
+            img_url = urljoin(self.base_url, src)
+            return build_start_tag("img", replace_attr(image.attrs, "src", img_url)), (
+                cover_image_path
+            )
+        img_url, local_path, result = download
+        if isinstance(result, Exception):
+            logging.error(f"Failed to download {img_url}: {result}")
+            return build_start_tag("img", image.attrs), cover_image_path or local_path
+        if result is None:
+            return "", None
+        # Transcoding may have changed the extension
+        local_path = result
+        if not cover_image_path:
+            return "", local_path
+        return (
+            build_start_tag(
+                "img", replace_attr(image.attrs, "src", os.path.basename(local_path))
+            ),
+            cover_image_path,
+        )
+
+
+def is_sibling_image(image, container_uid):
+    uids = [uid for uid, _ in image.ancestors]
+    if container_uid not in uids:
+        return False
+    below = image.ancestors[uids.index(container_uid) + 1 :]
+    return not below or below[0][1] in ("p", "a")
+
+
+def with_style(attrs, style):
+    return replace_attr(attrs, "style", style)
+
+
+def replace_attr(attrs, name, value):
+    replaced = [(k, v) for k, v in attrs if k != name]
+    replaced.append((name, value))
+    return replaced
+
+
+def build_start_tag(tag, attrs):
+    attribute_string = "".join(
+        f" {k}" if v is None else f' {k}="{html.escape(v)}"' for k, v in attrs
+    )
+    return f"<{tag}{attribute_string}>"
+
+
+def remove_excessive_elements(html_content, url, img_dir):
+    return GutenbergAuCleaner(url, img_dir).clean(html_content)
@@ -0,0 +1,60 @@
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "32"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "8"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.3"))
+
+_local = threading.local()
+
+
+def _build_session():
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    # One pool per upstream host, kept alive between requests
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    logging.info(f"Created HTTP session for worker {os.getpid()}")
+    return session
+
+
+def get_session():
+    # Sessions (and their sockets) must never be shared across a fork,
+    # so each gunicorn worker lazily builds its own on first use.
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        _local.session = _build_session()
+        _local.pid = pid
+    return _local.session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_TIMEOUT))
+    return get_session().get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_TIMEOUT))
+    return get_session().head(url, **kwargs)
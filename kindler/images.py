@@ -0,0 +1,208 @@
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, UnidentifiedImageError
+
+from kindler import http_client
+from kindler.util import CHUNK_SIZE
+
+IMAGE_FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", "8"))
+IMAGE_CACHE_DIR = os.getenv(
+    "IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "kindler-images")
+)
+IMAGE_CACHE_MAX_SIZE = int(os.getenv("IMAGE_CACHE_MAX_SIZE", str(512 * 1024 * 1024)))
+# Grayscale and downscale images for e-ink screens before conversion
+IMAGE_TRANSCODE = os.getenv("IMAGE_TRANSCODE", "false").lower() == "true"
+IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "1072"))
+IMAGE_MAX_HEIGHT = int(os.getenv("IMAGE_MAX_HEIGHT", "1448"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "75"))
+# Larger downloads are dropped from the book
+IMAGE_MAX_SIZE = int(os.getenv("IMAGE_MAX_SIZE", str(10 * 1024 * 1024)))
+
+# Drawings and text scans compress better (and stay crisper) as PNG
+LOSSLESS_FORMATS = {"PNG", "GIF", "BMP", "TIFF"}
+FORMAT_EXTENSIONS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "GIF": ".gif",
+    "BMP": ".bmp",
+    "TIFF": ".tif",
+    "WEBP": ".webp",
+}
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_stored = 0
+
+
+def get_executor():
+    # Worker threads keep their own pooled HTTP session, so they are reused
+    # across books, but never shared across a fork
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=IMAGE_FETCH_WORKERS, thread_name_prefix="image-fetch"
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def submit(url, local_path):
+    return get_executor().submit(fetch_image, url, local_path)
+
+
+def fetch_images(downloads):
+    """Fetch (url, local_path) pairs in parallel.
+
+    Returns one result per download, in order: the path the image was saved
+    to, None when there was no usable image, or the exception raised.
+    """
+    futures = [submit(url, local_path) for url, local_path in downloads]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def fetch_image(url, local_path):
+    """Save the image at url to local_path, returning the path it was saved to.
+
+    The extension of local_path is replaced by the one of the image format.
+    """
+    cached = cached_path(url)
+    try:
+        os.utime(cached)
+    except FileNotFoundError:
+        data = download(url)
+        if data is None:
+            return None
+        store(cached, data)
+    local_path = os.path.splitext(local_path)[0] + image_extension(cached, url)
+    try:
+        os.link(cached, local_path)
+    except OSError:
+        shutil.copyfile(cached, local_path)
+    return local_path
+
+
+def download(url):
+    with http_client.get(url, stream=True) as response:
+        if response.status_code != 200:
+            return None
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > IMAGE_MAX_SIZE:
+            logging.warning(f"Skipping image {url}, {length} bytes is too large")
+            return None
+        data = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            data += chunk
+            if len(data) > IMAGE_MAX_SIZE:
+                logging.warning(f"Skipping image {url}, over {IMAGE_MAX_SIZE} bytes")
+                return None
+        content_type = response.headers.get("Content-Type", "")
+    # Error pages served with a 200 must not end up in the cache
+    if not is_image(content_type, data):
+        logging.warning(f"Skipping {url}, not an image ({content_type})")
+        return None
+    return bytes(data)
+
+
+def is_image(content_type, data):
+    if content_type.split(";")[0].strip().lower().startswith("image/"):
+        return True
+    # Some servers send images as application/octet-stream
+    try:
+        with Image.open(io.BytesIO(data)):
+            return True
+    except (UnidentifiedImageError, OSError):
+        return False
+
+
+def cached_path(url):
+    key = hashlib.sha1(
+        f"{url}\n{IMAGE_TRANSCODE}:{IMAGE_MAX_WIDTH}x{IMAGE_MAX_HEIGHT}".encode("utf-8")
+    ).hexdigest()
+    # No extension, so a lookup is a single stat: the format is read from
+    # the file when it's linked into a book
+    return os.path.join(IMAGE_CACHE_DIR, key[:2], key)
+
+
+def image_extension(path, url):
+    try:
+        # Only reads the header
+        with Image.open(path) as image:
+            ext = FORMAT_EXTENSIONS.get(image.format)
+    except (UnidentifiedImageError, OSError):
+        ext = None
+    return ext or os.path.splitext(url.split("?")[0])[1].lower() or ".jpg"
+
+
+def store(path, data):
+    global _stored
+    if IMAGE_TRANSCODE:
+        data = transcode(data)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    with _executor_lock:
+        _stored += len(data)
+        if _stored < IMAGE_CACHE_MAX_SIZE // 10:
+            return
+        _stored = 0
+    prune()
+
+
+def transcode(data):
+    try:
+        image = Image.open(io.BytesIO(data))
+        lossless = image.format in LOSSLESS_FORMATS
+        image.thumbnail((IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT))
+        if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+            # Transparent areas would turn black, flatten them on white paper
+            image = image.convert("RGBA")
+            image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image)
+        image = image.convert("L")
+    except (UnidentifiedImageError, OSError) as e:
+        logging.warning(f"Cannot transcode image, keeping it as is: {e}")
+        return data
+    output = io.BytesIO()
+    if lossless:
+        image.save(output, "PNG", optimize=True)
+    else:
+        image.save(output, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def prune():
+    # Drop least recently used images until the cache fits its budget
+    files = []
+    for root, _, names in os.walk(IMAGE_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= IMAGE_CACHE_MAX_SIZE:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
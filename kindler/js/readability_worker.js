@@ -0,0 +1,39 @@
+/*
+ * Long-lived Readability.js worker used by kindler.readability_pool.
+ *
+ * Reads one JSON job per line from stdin ({"html": "..."}) and writes one
+ * JSON result per line to stdout ({"title": ..., "content": ...} or
+ * {"error": ...}). Dependencies are resolved through NODE_PATH, pointing at
+ * the node_modules installed by readabilipy.
+ */
+
+const readline = require('readline');
+const { Readability } = require('@mozilla/readability');
+const { JSDOM } = require('jsdom');
+
+function parse(html) {
+	const dom = new JSDOM(html);
+	try {
+		const article = new Readability(dom.window.document).parse();
+		return {
+			title: article ? article.title : null,
+			content: article ? article.content : null,
+		};
+	} finally {
+		dom.window.close();
+	}
+}
+
+const lines = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+
+lines.on('line', (line) => {
+	let result;
+	try {
+		result = parse(JSON.parse(line).html);
+	} catch (error) {
+		result = { error: String(error) };
+	}
+	process.stdout.write(JSON.stringify(result) + '\n');
+});
+
+lines.on('close', () => process.exit(0));
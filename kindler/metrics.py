@@ -0,0 +1,86 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+import redis
+
+from kindler.cache import redis_client
+
+METRICS_KEY = "kindler:metrics"
+# Counters updated on every response are summed in each process and written
+# to Redis at most this often, in seconds
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "10"))
+
+
+def incr(name, amount=1):
+    try:
+        redis_client.hincrby(METRICS_KEY, name, amount)
+    except redis.RedisError as e:
+        logging.warning(f"Failed to update metric {name}: {e}")
+
+
+def get_all():
+    try:
+        values = redis_client.hgetall(METRICS_KEY)
+    except redis.RedisError as e:
+        logging.warning(f"Failed to read metrics: {e}")
+        return {}
+    return {key.decode("utf-8"): int(value) for key, value in sorted(values.items())}
+
+
+class CounterBatch:
+    """Sums counter increments in this process and writes them in one round trip.
+
+    Increments are written once METRICS_FLUSH_INTERVAL has passed since the
+    last write, by the increment that notices it, and when the process exits.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Increments of the parent must not be written again by a forked child
+        self.pid = os.getpid()
+        self.pending = {}
+        self.flushed_at = time.monotonic()
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            self.pending[name] = self.pending.get(name, 0) + amount
+            if time.monotonic() - self.flushed_at < self.interval:
+                return
+            pending = self._take()
+        self._write(pending)
+
+    def flush(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            pending = self._take()
+        self._write(pending)
+
+    def _take(self):
+        pending, self.pending = self.pending, {}
+        self.flushed_at = time.monotonic()
+        return pending
+
+    def _write(self, pending):
+        if not pending:
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for name, amount in pending.items():
+                pipe.hincrby(METRICS_KEY, name, amount)
+            pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Failed to update {len(pending)} metrics: {e}")
+
+
+batch = CounterBatch(METRICS_FLUSH_INTERVAL)
+atexit.register(batch.flush)
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+
+import readabilipy
+
+READABILITY_POOL_SIZE = int(os.getenv("READABILITY_POOL_SIZE", "2"))
+READABILITY_JOB_TIMEOUT = float(os.getenv("READABILITY_JOB_TIMEOUT", "10"))
+READABILITY_MAX_JOBS = int(os.getenv("READABILITY_MAX_JOBS", "200"))
+# How long a request waits for a busy worker before falling back
+READABILITY_ACQUIRE_TIMEOUT = float(os.getenv("READABILITY_ACQUIRE_TIMEOUT", "0.5"))
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "js", "readability_worker.js")
+NODE_MODULES = os.path.join(
+    os.path.dirname(readabilipy.__file__), "javascript", "node_modules"
+)
+
+
+class ReadabilityPoolError(Exception):
+    pass
+
+
+class ReadabilityPoolSaturated(ReadabilityPoolError):
+    pass
+
+
+class ReadabilityPoolUnavailable(ReadabilityPoolError):
+    pass
+
+
+class ReadabilityWorker:
+    def __init__(self):
+        self.process = subprocess.Popen(
+            ["node", WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env={**os.environ, "NODE_PATH": NODE_MODULES},
+        )
+        self.buffer = bytearray()
+        self.jobs = 0
+
+    def parse(self, html, timeout):
+        self.jobs += 1
+        try:
+            job = json.dumps({"html": html}).encode("utf-8") + b"\n"
+            self.process.stdin.write(job)
+            self.process.stdin.flush()
+        except OSError as e:
+            raise ReadabilityPoolError(f"Readability worker is gone: {e}")
+        try:
+            result = json.loads(self._read_line(timeout))
+        except ValueError as e:
+            raise ReadabilityPoolError(f"Unreadable readability worker output: {e}")
+        if not isinstance(result, dict):
+            raise ReadabilityPoolError("Unexpected readability worker output")
+        if "error" in result:
+            raise ReadabilityPoolError(result["error"])
+        return result
+
+    def _read_line(self, timeout):
+        deadline = time.monotonic() + timeout
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ReadabilityPoolError("Readability job timed out")
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                raise ReadabilityPoolError("Readability worker exited")
+            self.buffer += data
+        line, _, rest = self.buffer.partition(b"\n")
+        self.buffer = bytearray(rest)
+        return line
+
+    def close(self, kill=False):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        if kill:
+            self.process.kill()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class ReadabilityPool:
+    def __init__(self, size, job_timeout, max_jobs, acquire_timeout):
+        self.size = size
+        self.job_timeout = job_timeout
+        self.max_jobs = max_jobs
+        self.acquire_timeout = acquire_timeout
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Workers (and their pipes) must never be shared across a fork
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue()
+        self.started = 0
+
+    def parse(self, html):
+        worker = self._acquire()
+        healthy = False
+        try:
+            result = worker.parse(html, self.job_timeout)
+            healthy = True
+            return result
+        finally:
+            self._release(worker, healthy)
+
+    def _acquire(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self.started < self.size:
+                worker = self._start_worker()
+                self.started += 1
+                return worker
+        try:
+            return self.idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise ReadabilityPoolSaturated("All readability workers are busy")
+
+    def _release(self, worker, healthy):
+        if healthy and worker.jobs < self.max_jobs:
+            self.idle.put(worker)
+            return
+        # Broken, timed out or worn out workers are replaced on next demand
+        worker.close(kill=not healthy)
+        with self.lock:
+            self.started -= 1
+
+    def _start_worker(self):
+        if not os.path.isdir(NODE_MODULES):
+            raise ReadabilityPoolUnavailable("Readability.js is not installed")
+        try:
+            worker = ReadabilityWorker()
+        except OSError as e:
+            raise ReadabilityPoolUnavailable(f"Cannot start readability worker: {e}")
+        logging.info(f"Started readability worker {worker.process.pid}")
+        return worker
+
+
+pool = ReadabilityPool(
+    READABILITY_POOL_SIZE,
+    READABILITY_JOB_TIMEOUT,
+    READABILITY_MAX_JOBS,
+    READABILITY_ACQUIRE_TIMEOUT,
+)
@@ -1,8 +1,42 @@
+import bisect
+import hashlib
 import logging
 import os
+import numpy as np
 import pandas as pd
 from rapidfuzz import process, fuzz
 import re
+from collections import defaultdict
+
+from kindler import search_fulltext, search_index, search_similar
+from kindler.search_fulltext import FULLTEXT_FILE, FullTextIndex
+from kindler.search_index import LineColumn, StringColumn, StringTable
+
+# Threads used to score a batch of queries, -1 for one per CPU
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "1"))
+# Share of trigrams a row must have in common with a query to be scored,
+# relative to the shorter of the two
+SEARCH_MIN_OVERLAP = float(os.getenv("SEARCH_MIN_OVERLAP", "0.4"))
+# Below this many candidates, all rows are scored
+SEARCH_MIN_CANDIDATES = int(os.getenv("SEARCH_MIN_CANDIDATES", "10"))
+# Index built by scripts/build_search_index.py, looked up in the usual places
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH")
+
+# Weight of the summary ranking, relative to the title and author one
+SEARCH_FULLTEXT_WEIGHT = float(os.getenv("SEARCH_FULLTEXT_WEIGHT", "1"))
+# Damps the lead of the first ranks when merging rankings (reciprocal rank
+# fusion), the usual value
+RANK_FUSION_K = 60
+
+SCORED_COLUMNS = ("title_norm", "author_norm", "combined_norm")
+NO_MATCHES = (np.empty(0, dtype=np.int64), np.empty(0))
+SUGGEST_TITLE = 0
+SUGGEST_AUTHOR = 1
+# Shorter prefixes match plenty without allowing typos
+SUGGEST_MIN_TYPO_LENGTH = 3
+# Bytes of each suggestion key kept in a fixed-width array, for vectorized
+# prefix lookups
+SUGGEST_HEAD_SIZE = 16
 
 
 class FuzzySearcher:
@@ -11,24 +45,84 @@ class FuzzySearcher:
         "../scripts/index_with_summary.csv",
         "/app/scripts/index_with_summary.csv",
     ]
+    possible_index_paths = [
+        "scripts/search_index",
+        "../scripts/search_index",
+        "/app/scripts/search_index",
+    ]
 
-    def __init__(self):
-        for path in self.possible_paths:
-            if os.path.exists(path):
-                self.df = pd.read_csv(path, encoding="utf-8").fillna("")
-                logging.info(f"Loaded CSV from: {path}")
-                break
-        else:
-            raise FileNotFoundError(
-                f"CSV not found in any of the paths: {self.possible_paths}"
+    def __init__(self, index_path=None):
+        index_path = (
+            index_path or SEARCH_INDEX_PATH or find_path(self.possible_index_paths)
+        )
+        self.csv_path = find_path(self.possible_paths)
+        self.index_path = None
+        index_dir = None
+        if index_path and os.path.exists(index_path):
+            # The build the link points at now: files opened later, such as
+            # the full-text index, come from it even after a new one is
+            # swapped in
+            index_dir = os.path.realpath(index_path)
+            # Held until the searcher is dropped, so the build isn't removed
+            # under requests still using it
+            self.index_lock = search_index.hold(index_dir)
+            try:
+                arrays, meta = search_index.load(index_dir)
+                self.index_path = index_path
+                logging.info(
+                    f"Mapped search index {meta['version']} from: {index_path}"
+                )
+            except ValueError as e:
+                # e.g. built by another version, rebuild with build_search_index.py
+                logging.warning(f"Ignoring search index: {e}")
+        if not self.index_path:
+            # Every worker builds its own copy, fine for development only
+            if not self.csv_path:
+                raise FileNotFoundError(
+                    f"CSV not found in any of the paths: {self.possible_paths}"
+                )
+            logging.warning(
+                f"No usable search index, building one in memory from: {self.csv_path}"
             )
+            arrays, meta = build_index(self.csv_path)
 
-        self.df["title_norm"] = self.df["title"].map(self.normalize_text)
-        self.df["author_norm"] = self.df["author"].map(self.normalize_text)
-        self.df["combined_norm"] = (
-            self.df["title_norm"] + " " + self.df["author_norm"]
-        ).str.strip()
-        self.df = self.df[self.df["combined_norm"] != ""].copy()
+        self.version = meta["version"]
+        self.rows = meta["rows"]
+        fulltext_path = os.path.join(index_dir or "", FULLTEXT_FILE)
+        self.fulltext = (
+            FullTextIndex(fulltext_path)
+            if self.index_path and os.path.exists(fulltext_path)
+            else None
+        )
+        # Values of the catalog columns, to build results
+        self.columns = {
+            column: StringColumn.from_arrays(arrays, f"column.{column}")
+            for column in meta["columns"]
+        }
+        # Scored columns and the bonus for matching their beginning. They stay
+        # mapped too, only the rows being scored are decoded.
+        self.choices = [
+            LineColumn.from_arrays(arrays, f"column.{column}")
+            for column in SCORED_COLUMNS
+        ]
+        self.prefix_bonuses = [5, 3, 0]
+        # Results are sorted by author and title on equal scores
+        self.author_rank = arrays["author_rank"]
+        self.title_rank = arrays["title_rank"]
+        self.indexes = [
+            TrigramIndex.from_arrays(arrays, f"trigrams.{column}")
+            for column in SCORED_COLUMNS
+        ]
+        self.identifiers = StringTable.from_arrays(arrays, "identifiers")
+        # Sorted title and author word suffixes, for prefix lookups
+        self.suggestions = StringColumn.from_arrays(arrays, "suggest.keys")
+        self.suggestion_kinds = arrays["suggest.kinds"]
+        self.suggestion_rows = arrays["suggest.rows"]
+        self.suggestion_heads = arrays["suggest.heads"]
+        # Characters found in the keys, those a typo may have replaced
+        self.suggestion_alphabet = [chr(char) for char in arrays["suggest.alphabet"]]
+        # Rows of the books most similar to each one, -1 past the last
+        self.similar_rows = arrays["similar.rows"]
 
     @staticmethod
     def normalize_text(text):
@@ -43,78 +137,513 @@ class FuzzySearcher:
         limit: int = 50,
         score_cutoff: int = 80,
         scorer=fuzz.token_set_ratio,
+        exhaustive: bool = False,
+        offset: int = 0,
     ):
+        """Books ranked offset to offset + limit for query."""
         if not query:
             return []
+        rows, scores = self.rank_many(
+            [query], offset + limit, score_cutoff, scorer, exhaustive
+        )[0]
+        return self.records(rows[offset:], scores[offset:])
 
-        query_norm = self.normalize_text(query)
-        results = []
-        title_matches = process.extract(
-            query_norm,
-            self.df["title_norm"].tolist(),
-            scorer=scorer,
-            score_cutoff=score_cutoff,
-            limit=limit * 5,
-        )
-        for match, score, idx in title_matches:
-            weighted_score = (
-                score + 5
-                if self.df["title_norm"].iloc[idx].startswith(query_norm)
-                else score
+    def search_many(
+        self,
+        queries,
+        limit: int = 50,
+        score_cutoff: int = 80,
+        scorer=fuzz.token_set_ratio,
+        exhaustive: bool = False,
+    ):
+        """Search for several queries at once, returning one result list per query.
+
+        Unless exhaustive is set, only rows sharing enough trigrams with a
+        query are scored.
+        """
+        return [
+            self.records(rows, scores)
+            for rows, scores in self.rank_many(
+                queries, limit, score_cutoff, scorer, exhaustive
+            )
+        ]
+
+    def search_fulltext(
+        self, query: str, limit: int = 50, score_cutoff: int = 80, offset: int = 0
+    ):
+        """search(), mixed with the books whose summary matches the query.
+
+        Both rankings are merged by rank (reciprocal rank fusion), the
+        summary one weighted by SEARCH_FULLTEXT_WEIGHT, so a book matching
+        only by its summary can rank first. Scores are scaled to 0-100, 100
+        for a book ranked first by both.
+        """
+        rows, scores = self.rank_fulltext(query, offset + limit, score_cutoff)
+        return self.records(rows[offset:], scores[offset:])
+
+    def rank_fulltext(self, query, limit, score_cutoff):
+        # (rows, scores) of search_fulltext(), best first
+        if not query:
+            return NO_MATCHES
+        rows, scores = self.rank_many([query], limit, score_cutoff)[0]
+        if self.fulltext is None:
+            return rows, scores
+        fused = defaultdict(float)
+        for rank, row in enumerate(rows.tolist(), 1):
+            fused[row] += 1 / (RANK_FUSION_K + rank)
+        for rank, (row, _) in enumerate(self.fulltext.match(query, limit), 1):
+            fused[row] += SEARCH_FULLTEXT_WEIGHT / (RANK_FUSION_K + rank)
+        if not fused:
+            return NO_MATCHES
+        rows = np.fromiter(fused, dtype=np.int64, count=len(fused))
+        scores = np.fromiter(fused.values(), dtype=np.float64, count=len(fused))
+        scores *= 100 * (RANK_FUSION_K + 1) / (1 + SEARCH_FULLTEXT_WEIGHT)
+        order = np.lexsort(
+            (rows, self.title_rank[rows], self.author_rank[rows], -scores)
+        )[:limit]
+        return rows[order], scores[order]
+
+    def rank_many(
+        self,
+        queries,
+        limit,
+        score_cutoff,
+        scorer=fuzz.token_set_ratio,
+        exhaustive=False,
+    ):
+        # (rows, scores) of the results of each query, best first
+        queries_norm = [self.normalize_text(query) for query in queries]
+        results = [NO_MATCHES for _ in queries]
+        full_scan = []
+        for i, (query, query_norm) in enumerate(zip(queries, queries_norm)):
+            if not query:
+                continue
+            rows = None if exhaustive else self.candidates(query_norm)
+            if rows is None:
+                full_scan.append(i)
+                continue
+            column_scores = self.score([query_norm], rows, score_cutoff, scorer)
+            results[i] = self.rank(
+                query_norm,
+                rows,
+                [scores[0] for scores in column_scores],
+                limit,
+                score_cutoff,
+            )
+
+        # Queries scored against every row share one batched pass per column
+        if full_scan:
+            column_scores = self.score(
+                [queries_norm[i] for i in full_scan], None, score_cutoff, scorer
+            )
+            for j, i in enumerate(full_scan):
+                results[i] = self.rank(
+                    queries_norm[i],
+                    None,
+                    [scores[j] for scores in column_scores],
+                    limit,
+                    score_cutoff,
+                )
+        return results
+
+    def candidates(self, query_norm):
+        """Rows worth scoring for query_norm, or None to score all of them."""
+        grams = trigrams(query_norm)
+        if not grams:
+            return None
+        rows = np.unique(
+            np.concatenate(
+                [index.matches(grams, SEARCH_MIN_OVERLAP) for index in self.indexes]
             )
-            results.append((idx, weighted_score))
-
-        author_matches = process.extract(
-            query_norm,
-            self.df["author_norm"].tolist(),
-            scorer=scorer,
-            score_cutoff=score_cutoff,
-            limit=limit * 5,
         )
-        for match, score, idx in author_matches:
-            weighted_score = (
-                score + 3
-                if self.df["author_norm"].iloc[idx].startswith(query_norm)
-                else score
+        # Too few candidates usually means a misspelled query, which fuzzy
+        # scoring may still match
+        if len(rows) < SEARCH_MIN_CANDIDATES:
+            return None
+        return rows
+
+    def score(self, queries_norm, rows, score_cutoff, scorer):
+        # One batched (and multi-threaded) scoring pass per column
+        return [
+            process.cdist(
+                queries_norm,
+                choices.to_list() if rows is None else choices.take(rows.tolist()),
+                scorer=scorer,
+                score_cutoff=score_cutoff,
+                dtype=np.float64,
+                workers=SEARCH_WORKERS,
             )
-            results.append((idx, weighted_score))
-
-        combined_matches = process.extract(
-            query_norm,
-            self.df["combined_norm"].tolist(),
-            scorer=scorer,
-            score_cutoff=score_cutoff,
-            limit=limit * 5,
+            for choices in self.choices
+        ]
+
+    def rank(self, query_norm, rows, column_scores, limit, score_cutoff):
+        # rows are the (sorted) rows that were scored, None for all of them
+        indices = []
+        weighted_scores = []
+        for choices, bonus, scores in zip(
+            self.choices, self.prefix_bonuses, column_scores
+        ):
+            idx = top_matches(scores, score_cutoff, limit * 5)
+            weighted = scores[idx]
+            if rows is not None:
+                idx = rows[idx]
+            if bonus:
+                weighted = weighted + bonus * np.fromiter(
+                    (choices[i].startswith(query_norm) for i in idx),
+                    dtype=bool,
+                    count=len(idx),
+                )
+            indices.append(idx)
+            weighted_scores.append(weighted)
+        indices = np.concatenate(indices)
+        if not len(indices):
+            return NO_MATCHES
+        weighted_scores = np.concatenate(weighted_scores)
+
+        # Best score per row, remembering where the row was first matched so
+        # rows with the same score, author and title keep their order
+        matched, first_match, inverse = np.unique(
+            indices, return_index=True, return_inverse=True
         )
-        for match, score, idx in combined_matches:
-            results.append((idx, score))
+        scores = np.full(len(matched), -np.inf)
+        np.maximum.at(scores, inverse, weighted_scores)
+        order = np.lexsort(
+            (
+                first_match,
+                self.title_rank[matched],
+                self.author_rank[matched],
+                -scores,
+            )
+        )[:limit]
+
+        return matched[order], scores[order]
+
+    def records(self, rows, scores):
+        return [self.record(row, float(score)) for row, score in zip(rows, scores)]
 
-        if not results:
+    def suggest(self, prefix: str, limit: int = 10):
+        """Titles and authors with a word starting with prefix.
+
+        When none are found, prefixes one edit away from it (a typo) are
+        tried instead, those starting the most keys first.
+        """
+        prefix = self.normalize_text(prefix)
+        if not prefix:
             return []
+        entries = {}
+        self.collect_suggestions(prefix, limit, entries)
+        if not entries and len(prefix) >= SUGGEST_MIN_TYPO_LENGTH:
+            for candidate in self.typo_prefixes(prefix):
+                self.collect_suggestions(candidate, limit, entries)
+                if len(entries) >= limit:
+                    break
+
+        suggestions = []
+        for kind, row in entries.values():
+            if kind == SUGGEST_AUTHOR:
+                suggestions.append(
+                    {"kind": "author", "author": self.columns["author"][row]}
+                )
+            else:
+                suggestions.append({"kind": "title", **self.record(row, 100)})
+        return suggestions
+
+    def collect_suggestions(self, prefix, limit, entries):
+        starts, ends = self.suggestion_ranges([prefix])
+        # Only narrowed down to the keys sharing the first SUGGEST_HEAD_SIZE
+        # bytes of prefix
+        start = bisect.bisect_left(self.suggestions, prefix, starts[0], ends[0])
+        for entry in range(start, ends[0]):
+            if len(entries) >= limit:
+                return
+            key = self.suggestions[entry]
+            if not key.startswith(prefix):
+                return
+            kind = int(self.suggestion_kinds[entry])
+            row = int(self.suggestion_rows[entry])
+            # A book (or author) is suggested once, whichever word matched
+            if kind == SUGGEST_AUTHOR:
+                display = ("author", self.columns["author"][row])
+            else:
+                display = ("title", row)
+            entries.setdefault(display, (kind, row))
 
-        scores_by_idx = {}
-        for idx, score in results:
-            if idx not in scores_by_idx or score > scores_by_idx[idx]:
-                scores_by_idx[idx] = score
+    def suggestion_ranges(self, prefixes):
+        """Bounds of the keys starting with each prefix, as (starts, ends).
 
-        df_results = self.df.iloc[list(scores_by_idx.keys())].copy()
-        df_results["score"] = df_results.index.map(scores_by_idx)
-        df_results = df_results.sort_values(
-            by=["score", "author", "title"],
-            ascending=[False, True, True],
+        Computed on the heads of the keys, so for prefixes longer than
+        SUGGEST_HEAD_SIZE bytes they include keys sharing only their head.
+        """
+        heads = [prefix.encode("utf-8") for prefix in prefixes]
+        dtype = self.suggestion_heads.dtype
+        starts = np.searchsorted(self.suggestion_heads, np.array(heads, dtype=dtype))
+        # No key holds a 0xff byte, which isn't valid UTF-8. Heads cut to
+        # SUGGEST_HEAD_SIZE lose it, and end past the keys sharing them.
+        ends = np.searchsorted(
+            self.suggestion_heads,
+            np.array([head + b"\xff" for head in heads], dtype=dtype),
+            side="right",
         )
+        return starts.tolist(), ends.tolist()
 
-        return df_results.head(limit).to_dict(orient="records")
+    def typo_prefixes(self, prefix):
+        """Prefixes one edit away from prefix that start a key, best first.
 
-    def lookup_by_remote_url(self, url: str):
-        if not url:
-            return None
-        mask = self.df["remote_url"].str.lower() == url.lower()
-        df_result = self.df[mask]
+        They are all at the same distance, so the ones starting the most keys
+        (the most popular words) come first.
+        """
+        # An edit only leads to a key if what comes before it starts one
+        starts, ends = self.suggestion_ranges([prefix[:i] for i in range(len(prefix))])
+        candidates = {}
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            if start == end:
+                break
+            head, char, tail = prefix[:i], prefix[i], prefix[i + 1 :]
+            # Left out, but only inside the prefix: without its last
+            # character it always matches, and replacing that is more precise
+            if tail:
+                candidates[head + tail] = None
+                # Swapped
+                candidates[head + tail[0] + char + tail[1:]] = None
+            for other in self.suggestion_alphabet:
+                # Replaced, and missing
+                candidates[head + other + tail] = None
+                candidates[head + other + char + tail] = None
+        candidates = list(candidates)
+        starts, ends = self.suggestion_ranges(candidates)
+        counts = np.subtract(ends, starts)
+        order = np.argsort(-counts, kind="stable")
+        return [candidates[i] for i in order[: np.count_nonzero(counts)]]
 
-        if df_result.empty:
+    def lookup(self, identifier: str):
+        """Find a book by its remote URL, location or relative location."""
+        if not identifier:
+            return None
+        row = self.identifiers.get(identifier_key(identifier))
+        if row is None:
             return None
+        return self.record(row, 100)
+
+    def lookup_by_remote_url(self, url: str):
+        return self.lookup(url)
 
-        result = df_result.iloc[0].to_dict()
-        result["score"] = 100
+    def similar(self, identifier: str):
+        """Books with a summary similar to the one of the book identified."""
+        if not identifier:
+            return []
+        row = self.identifiers.get(identifier_key(identifier))
+        if row is None:
+            return []
+        return [
+            self.record(int(similar), 100)
+            for similar in self.similar_rows[row]
+            if similar >= 0
+        ]
+
+    def record(self, row, score):
+        result = {column: values[row] for column, values in self.columns.items()}
+        result["score"] = score
         return result
+
+
+class TrigramIndex:
+    """Inverted index from character trigrams to the rows containing them."""
+
+    def __init__(self, grams, offsets, rows, sizes):
+        # Rows containing the trigram with posting number p are
+        # rows[offsets[p]:offsets[p + 1]]
+        self.grams = grams
+        self.offsets = offsets
+        self.rows = rows
+        self.sizes = sizes
+
+    @classmethod
+    def from_texts(cls, texts):
+        postings = defaultdict(list)
+        sizes = np.empty(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            grams = trigrams(text)
+            sizes[row] = len(grams)
+            for gram in grams:
+                postings[gram].append(row)
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        np.cumsum([len(rows) for rows in postings.values()], out=offsets[1:])
+        rows = np.fromiter(
+            (row for rows in postings.values() for row in rows),
+            dtype=np.int32,
+            count=int(offsets[-1]),
+        )
+        grams = StringTable.from_dict({gram: i for i, gram in enumerate(postings)})
+        return cls(grams, offsets, rows, sizes)
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        return cls(
+            StringTable.from_arrays(arrays, f"{name}.grams"),
+            arrays[f"{name}.offsets"],
+            arrays[f"{name}.rows"],
+            arrays[f"{name}.sizes"],
+        )
+
+    def to_arrays(self, name):
+        return {
+            **self.grams.to_arrays(f"{name}.grams"),
+            f"{name}.offsets": self.offsets,
+            f"{name}.rows": self.rows,
+            f"{name}.sizes": self.sizes,
+        }
+
+    def matches(self, grams, min_overlap):
+        postings = []
+        for gram in grams:
+            posting = self.grams.get(gram)
+            if posting is not None:
+                postings.append(
+                    self.rows[self.offsets[posting] : self.offsets[posting + 1]]
+                )
+        if not postings:
+            return np.empty(0, dtype=np.int32)
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.sizes))
+        # token_set_ratio scores a row contained in the query as high as a
+        # query contained in the row
+        needed = np.maximum(min_overlap * np.minimum(len(grams), self.sizes), 1)
+        return np.flatnonzero(shared >= needed)
+
+
+def build_index(csv_path, fulltext_path=None):
+    """Build the arrays of a search index from a catalog CSV.
+
+    Returns (arrays, meta), ready for search_index.write(). With
+    fulltext_path, the full-text index of the summaries is written there.
+    """
+    version = csv_version(csv_path)
+    df = pd.read_csv(csv_path, encoding="utf-8", dtype=str).fillna("")
+    catalog_columns = list(df.columns)
+    df["title_norm"] = df["title"].map(FuzzySearcher.normalize_text)
+    df["author_norm"] = df["author"].map(FuzzySearcher.normalize_text)
+    df["combined_norm"] = (df["title_norm"] + " " + df["author_norm"]).str.strip()
+    df = df[df["combined_norm"] != ""].reset_index(drop=True)
+
+    arrays = {
+        "author_rank": sort_rank(df["author"]),
+        "title_rank": sort_rank(df["title"]),
+    }
+    for column in catalog_columns:
+        arrays.update(
+            StringColumn.from_strings(df[column]).to_arrays(f"column.{column}")
+        )
+    for column in SCORED_COLUMNS:
+        # Normalized, so free of newlines
+        arrays.update(LineColumn.from_strings(df[column]).to_arrays(f"column.{column}"))
+    for column in SCORED_COLUMNS:
+        arrays.update(
+            TrigramIndex.from_texts(df[column].tolist()).to_arrays(f"trigrams.{column}")
+        )
+    identifiers = {}
+    for column in ("remote_url", "location", "relative_location"):
+        for row, identifier in enumerate(df[column]):
+            if identifier:
+                # The first row wins, like the mask lookup it replaced
+                identifiers.setdefault(identifier_key(identifier), row)
+    arrays.update(StringTable.from_dict(identifiers).to_arrays("identifiers"))
+    arrays.update(build_suggestions(df))
+    arrays.update(search_similar.build(df))
+    if fulltext_path:
+        search_fulltext.build(df, fulltext_path)
+
+    meta = {
+        "format": search_index.SEARCH_INDEX_FORMAT,
+        "version": version,
+        "rows": len(df),
+        "columns": catalog_columns,
+    }
+    return arrays, meta
+
+
+def build_suggestions(df):
+    entries = set()
+    for kind, column in (
+        (SUGGEST_TITLE, "title_norm"),
+        (SUGGEST_AUTHOR, "author_norm"),
+    ):
+        seen = set()
+        for row, text in enumerate(df[column]):
+            # Authors appear on many books, one row is enough to name them
+            if kind == SUGGEST_AUTHOR:
+                if text in seen:
+                    continue
+                seen.add(text)
+            words = text.split()
+            for i in range(len(words)):
+                entries.add((" ".join(words[i:]), kind, row))
+    entries = sorted(entries)
+    return {
+        **StringColumn.from_strings(key for key, _, _ in entries).to_arrays(
+            "suggest.keys"
+        ),
+        "suggest.kinds": np.array([kind for _, kind, _ in entries], dtype=np.int8),
+        "suggest.rows": np.array([row for _, _, row in entries], dtype=np.int32),
+        "suggest.heads": np.array(
+            [key.encode("utf-8") for key, _, _ in entries],
+            dtype=f"S{SUGGEST_HEAD_SIZE}",
+        ),
+        "suggest.alphabet": np.array(
+            sorted({ord(char) for key, _, _ in entries for char in key}),
+            dtype=np.int32,
+        ),
+    }
+
+
+def write_index(csv_path, output_path):
+    """Build the index of csv_path and write it to output_path."""
+    fulltext_path = f"{output_path}.{FULLTEXT_FILE}.{os.getpid()}"
+    arrays, meta = build_index(csv_path, fulltext_path)
+    search_index.write(output_path, arrays, meta, {FULLTEXT_FILE: fulltext_path})
+    return arrays, meta
+
+
+def rebuild_index(csv_path, output_path):
+    """Same as write_index(), meant to run in its own process."""
+    # Leave the CPU to the workers answering requests
+    os.nice(10)
+    write_index(csv_path, output_path)
+
+
+def csv_version(csv_path):
+    with open(csv_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def find_path(paths):
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def identifier_key(identifier):
+    # http and https, letter case and trailing slashes don't tell books apart
+    key = str(identifier).strip().lower()
+    for scheme in ("https://", "http://"):
+        if key.startswith(scheme):
+            key = key[len(scheme) :]
+            break
+    return key.strip("/")
+
+
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def top_matches(scores, score_cutoff, limit):
+    # Same selection and order as process.extract: best scores first,
+    # then earlier rows
+    idx = np.flatnonzero(scores >= score_cutoff)
+    return idx[np.argsort(-scores[idx], kind="stable")[:limit]]
+
+
+def sort_rank(column):
+    # Position of each value in sorted order, equal values sharing a rank
+    ranks = np.unique(column.to_numpy(dtype=object), return_inverse=True)[1]
+    return ranks.astype(np.int32)
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import redis
+
+from kindler import metrics
+from kindler.cache import redis_client
+
+# Books ranked per query, all the pages of its results
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))
+# Rankings kept per worker process, on top of the Redis tier shared by all
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "256"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(24 * 3600)))
+# Most frequent queries of the log searched ahead when an index is loaded
+SEARCH_WARM_QUERIES = int(os.getenv("SEARCH_WARM_QUERIES", "100"))
+SEARCH_QUERY_LOG_SIZE = int(os.getenv("SEARCH_QUERY_LOG_SIZE", "10000"))
+# "fuzzy" matches titles and authors, "fulltext" summaries too
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "fuzzy")
+
+RANKING_KEY = "search:ranking:"
+QUERY_LOG_KEY = "search:queries"
+WARM_UP_LOCK_KEY = "search:warm_up:"
+WARM_UP_LOCK_TTL = 10 * 60
+# Trim the query log every so many searches, not on every one
+QUERY_LOG_TRIM_EVERY = 1000
+
+_results = OrderedDict()
+_lock = threading.Lock()
+_logged = 0
+
+
+def search(searcher, query, limit=50, offset=0, score_cutoff=80):
+    """Books ranked offset to offset + limit for query, and how many were ranked.
+
+    Searches use SEARCH_BACKEND. The ranking of a query is cached, so its
+    next pages are only slices of it.
+    """
+    if not query:
+        return [], 0
+    if not offset:
+        log_query(query)
+    rows, scores = ranking(searcher, query, score_cutoff)
+    books = searcher.records(
+        rows[offset : offset + limit], scores[offset : offset + limit]
+    )
+    return books, len(rows)
+
+
+def ranking(searcher, query, score_cutoff):
+    # (rows, scores) of the books matching query, best first
+    key = cache_key(searcher, query, score_cutoff)
+    ranked = get_local(key)
+    if ranked is not None:
+        metrics.incr("search_cache.hit.local")
+        return ranked
+    try:
+        cached = redis_client.get(key)
+    except redis.RedisError as e:
+        logging.warning(f"Failed to read cached search results: {e}")
+        cached = None
+    if cached is not None:
+        metrics.incr("search_cache.hit.redis")
+        cached = json.loads(cached)
+        ranked = (
+            np.array(cached["rows"], dtype=np.int64),
+            np.array(cached["scores"], dtype=np.float64),
+        )
+    else:
+        metrics.incr("search_cache.miss")
+        ranked = rank(searcher, [query], score_cutoff)[0]
+        put_redis(key, ranked)
+    put_local(key, ranked)
+    return ranked
+
+
+def rank(searcher, queries, score_cutoff):
+    if SEARCH_BACKEND == "fulltext":
+        return [
+            searcher.rank_fulltext(query, SEARCH_MAX_RESULTS, score_cutoff)
+            for query in queries
+        ]
+    return searcher.rank_many(queries, SEARCH_MAX_RESULTS, score_cutoff)
+
+
+def cache_key(searcher, query, score_cutoff):
+    # Rankings only depend on the normalized query, and are only valid for
+    # the index version and backend they were computed with
+    params = (
+        f"{SEARCH_BACKEND}\n{searcher.normalize_text(query)}\n"
+        f"{SEARCH_MAX_RESULTS}\n{score_cutoff}"
+    )
+    digest = hashlib.sha1(params.encode("utf-8")).hexdigest()
+    return f"{RANKING_KEY}{searcher.version}:{digest}"
+
+
+def get_local(key):
+    with _lock:
+        ranked = _results.get(key)
+        if ranked is not None:
+            _results.move_to_end(key)
+        return ranked
+
+
+def put_local(key, ranked):
+    with _lock:
+        _results[key] = ranked
+        _results.move_to_end(key)
+        while len(_results) > SEARCH_CACHE_SIZE:
+            _results.popitem(last=False)
+
+
+def put_redis(key, ranked):
+    rows, scores = ranked
+    try:
+        redis_client.set(
+            key,
+            json.dumps({"rows": rows.tolist(), "scores": scores.tolist()}),
+            ex=SEARCH_CACHE_TTL,
+        )
+    except redis.RedisError as e:
+        logging.warning(f"Failed to cache search results: {e}")
+
+
+def log_query(query):
+    global _logged
+    with _lock:
+        _logged += 1
+        trim = _logged % QUERY_LOG_TRIM_EVERY == 0
+    try:
+        pipe = redis_client.pipeline()
+        pipe.zincrby(QUERY_LOG_KEY, 1, query.strip())
+        if trim:
+            # Keep the most frequent queries only
+            pipe.zremrangebyrank(QUERY_LOG_KEY, 0, -SEARCH_QUERY_LOG_SIZE - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logging.warning(f"Failed to log search query: {e}")
+
+
+def start_warm_up(searcher):
+    if SEARCH_WARM_QUERIES > 0:
+        threading.Thread(
+            target=warm_up, args=(searcher,), name="search-warm-up", daemon=True
+        ).start()
+
+
+def warm_up(searcher, score_cutoff=80):
+    """Search the most frequent logged queries into the Redis tier.
+
+    Only one worker does it per index version, the others read its results.
+    """
+    try:
+        if not redis_client.set(
+            WARM_UP_LOCK_KEY + searcher.version, 1, nx=True, ex=WARM_UP_LOCK_TTL
+        ):
+            return
+        queries = [
+            query.decode("utf-8")
+            for query in redis_client.zrevrange(
+                QUERY_LOG_KEY, 0, SEARCH_WARM_QUERIES - 1
+            )
+        ]
+        keys = {}
+        for query in queries:
+            key = cache_key(searcher, query, score_cutoff)
+            if query and key not in keys and not redis_client.exists(key):
+                keys[key] = query
+        if not keys:
+            return
+        for key, ranked in zip(keys, rank(searcher, list(keys.values()), score_cutoff)):
+            put_redis(key, ranked)
+        metrics.incr("search_cache.warmed", len(keys))
+        logging.info(
+            f"Warmed up {len(keys)} searches for index version {searcher.version}"
+        )
+    except redis.RedisError as e:
+        logging.warning(f"Failed to warm up search results: {e}")
@@ -0,0 +1,93 @@
+import os
+import re
+import sqlite3
+import threading
+
+FULLTEXT_FILE = "fulltext.sqlite"
+# Columns searched by topic, and their BM25 weights
+FULLTEXT_COLUMNS = {"summary": 1.0, "description": 0.5}
+# Read through the page cache, shared by all workers, instead of a heap
+# cache per connection
+FULLTEXT_MMAP_SIZE = 256 * 1024 * 1024
+
+WORD_RE = re.compile(r"\w+")
+
+
+def build(df, path):
+    """Write a full-text index of the summaries of df's rows to path.
+
+    The index is contentless: it maps words to rows, the text itself stays
+    in the search index arrays.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    columns = ", ".join(FULLTEXT_COLUMNS)
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute(
+            f"CREATE VIRTUAL TABLE books USING fts5({columns}, content='', "
+            "tokenize='porter unicode61')"
+        )
+        connection.executemany(
+            f"INSERT INTO books(rowid, {columns}) "
+            f"VALUES (?, {', '.join('?' for _ in FULLTEXT_COLUMNS)})",
+            zip(
+                range(len(df)),
+                *(
+                    df[column] if column in df else [""] * len(df)
+                    for column in FULLTEXT_COLUMNS
+                ),
+            ),
+        )
+        connection.execute("INSERT INTO books(books) VALUES ('optimize')")
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class FullTextIndex:
+    """Read-only BM25 search over a database written by build()."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        weights = ", ".join(str(weight) for weight in FULLTEXT_COLUMNS.values())
+        self.query = (
+            f"SELECT rowid, bm25(books, {weights}) AS rank FROM books "
+            "WHERE books MATCH ? ORDER BY rank LIMIT ?"
+        )
+
+    def connection(self):
+        # sqlite3 connections can't be shared between threads. Each thread
+        # opens path, so it must be a build's own file and never replaced.
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                f"file:{self.path}?mode=ro&immutable=1", uri=True
+            )
+            connection.execute(f"PRAGMA mmap_size = {FULLTEXT_MMAP_SIZE}")
+            self.local.connection = connection
+        return connection
+
+    def match(self, query, limit):
+        """Return (row, score) pairs, best first, scores relative to the best.
+
+        Books must contain all the words of the query, or any of them when
+        none contains all.
+        """
+        words = WORD_RE.findall(query.lower())
+        if not words:
+            return []
+        quoted = [f'"{word}"' for word in words]
+        matches = self.connection().execute(self.query, (" ".join(quoted), limit))
+        matches = matches.fetchall()
+        if not matches and len(words) > 1:
+            matches = self.connection().execute(
+                self.query, (" OR ".join(quoted), limit)
+            )
+            matches = matches.fetchall()
+        if not matches:
+            return []
+        # BM25 ranks are negative, the best one the lowest
+        best = matches[0][1] or -1.0
+        return [(row, rank / best) for row, rank in matches]
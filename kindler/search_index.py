@@ -0,0 +1,241 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+# Bump when the layout of the files changes
+SEARCH_INDEX_FORMAT = 5
+META_FILE = "meta.json"
+# Builds without a meta file are still being written, unless this old
+ABANDONED_BUILD_AGE = 3600
+
+
+class StringColumn:
+    """Strings stored as UTF-8 bytes back to back, with their offsets."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        # Indexing memoryviews skips the NumPy scalar machinery, which
+        # matters when bisecting
+        self.data_view = memoryview(data)
+        self.offsets_view = memoryview(offsets)
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        # Empty files can't be memory-mapped
+        data = np.frombuffer(b"".join(encoded) or b"\0", dtype=np.uint8)
+        return cls(data, offsets)
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        return cls(arrays[f"{name}.data"], arrays[f"{name}.offsets"])
+
+    def to_arrays(self, name):
+        return {f"{name}.data": self.data, f"{name}.offsets": self.offsets}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets_view[i], self.offsets_view[i + 1]
+        return str(self.data_view[start:end], "utf-8")
+
+    def take(self, rows):
+        # Only the strings asked for are decoded, straight from the mapping
+        data, offsets = self.data_view, self.offsets_view
+        return [str(data[offsets[i] : offsets[i + 1]], "utf-8") for i in rows]
+
+    def to_list(self):
+        # Decoding from one copy of the bytes is much faster than item by item
+        raw = self.data.tobytes()
+        bounds = self.offsets.tolist()
+        return [
+            raw[start:end].decode("utf-8") for start, end in zip(bounds, bounds[1:])
+        ]
+
+
+class LineColumn(StringColumn):
+    """StringColumn of strings without newlines, each stored followed by one.
+
+    Decoding the whole column is then a single split, rather than a slice
+    per string.
+    """
+
+    @classmethod
+    def from_strings(cls, strings):
+        return super().from_strings(f"{string}\n" for string in strings)
+
+    def __getitem__(self, i):
+        start, end = self.offsets_view[i], self.offsets_view[i + 1] - 1
+        return str(self.data_view[start:end], "utf-8")
+
+    def take(self, rows):
+        data, offsets = self.data_view, self.offsets_view
+        return [str(data[offsets[i] : offsets[i + 1] - 1], "utf-8") for i in rows]
+
+    def to_list(self):
+        return self.data.tobytes().decode("utf-8").split("\n")[: len(self)]
+
+
+class StringTable:
+    """Read-only hash table from strings to integers, stored in flat arrays."""
+
+    def __init__(self, keys, values, slots):
+        self.keys = keys
+        self.values = values
+        self.slots = slots
+
+    @classmethod
+    def from_dict(cls, items):
+        size = 2
+        while size < 2 * len(items):
+            size *= 2
+        slots = [-1] * size
+        for entry, key in enumerate(items):
+            # Linear probing, the table is never more than half full
+            slot = key_hash(key) & (size - 1)
+            while slots[slot] != -1:
+                slot = (slot + 1) & (size - 1)
+            slots[slot] = entry
+        return cls(
+            StringColumn.from_strings(items),
+            np.array(list(items.values()), dtype=np.int64),
+            np.array(slots, dtype=np.int32),
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        return cls(
+            StringColumn.from_arrays(arrays, f"{name}.keys"),
+            arrays[f"{name}.values"],
+            arrays[f"{name}.slots"],
+        )
+
+    def to_arrays(self, name):
+        return {
+            **self.keys.to_arrays(f"{name}.keys"),
+            f"{name}.values": self.values,
+            f"{name}.slots": self.slots,
+        }
+
+    def get(self, key, default=None):
+        mask = len(self.slots) - 1
+        slot = key_hash(key) & mask
+        while (entry := self.slots[slot]) != -1:
+            if self.keys[entry] == key:
+                return int(self.values[entry])
+            slot = (slot + 1) & mask
+        return default
+
+
+def key_hash(key):
+    # Stable across processes, unlike hash()
+    return zlib.crc32(key.encode("utf-8"))
+
+
+def write(path, arrays, meta, files=None):
+    """Write an index and point path at it, replacing any previous one.
+
+    path is a symlink to a directory per build, next to it, and is swapped
+    in one step so readers always find a whole index there. Directories of
+    older builds are removed once no process holds them (see hold()). files
+    maps names to files moved into the index along with the arrays.
+    """
+    directory = f"{path}.{meta['version']}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(directory)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array, allow_pickle=False)
+    for name, file_path in (files or {}).items():
+        os.replace(file_path, os.path.join(directory, name))
+    with open(os.path.join(directory, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({**meta, "arrays": sorted(arrays)}, f, indent=2)
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        # Written before indexes were versioned, moved aside once
+        os.rename(path, f"{path}.previous-{uuid.uuid4().hex[:8]}")
+    link = f"{path}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(directory), link)
+    os.replace(link, path)
+    remove_stale(path)
+
+
+def hold(path):
+    """Keep the build at path from being removed while the file returned is open.
+
+    Holders take a shared lock on its meta file, which the kernel releases
+    when the file is closed, or with the process if it dies.
+    """
+    lock = open(os.path.join(path, META_FILE), "rb")
+    fcntl.flock(lock, fcntl.LOCK_SH)
+    # Removed while waiting for the lock
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        lock.close()
+        raise FileNotFoundError(f"Search index at {path} was removed")
+    return lock
+
+
+def remove_stale(path):
+    """Remove the builds next to path that it doesn't point at, nor are held."""
+    current = os.path.realpath(path)
+    parent = os.path.dirname(os.path.abspath(path))
+    prefix = f"{os.path.basename(path)}."
+    for name in os.listdir(parent):
+        directory = os.path.join(parent, name)
+        if (
+            name.startswith(prefix)
+            and os.path.isdir(directory)
+            and not os.path.islink(directory)
+            and os.path.realpath(directory) != current
+        ):
+            remove_unheld(directory)
+
+
+def remove_unheld(directory):
+    try:
+        lock = open(os.path.join(directory, META_FILE), "rb")
+    except FileNotFoundError:
+        # Nothing reads a build before its meta file is written, last
+        try:
+            if time.time() - os.path.getmtime(directory) > ABANDONED_BUILD_AGE:
+                shutil.rmtree(directory, ignore_errors=True)
+        except OSError:
+            pass
+        return
+    with lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def load(path):
+    """Memory-map the index at path, returning (arrays, meta).
+
+    Pages of the files are shared by every process mapping them. The link
+    at path is resolved once, so all files come from the same build.
+    """
+    path = os.path.realpath(path)
+    with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format") != SEARCH_INDEX_FORMAT:
+        raise ValueError(
+            f"Search index at {path} has format {meta.get('format')}, "
+            f"expected {SEARCH_INDEX_FORMAT}"
+        )
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name in meta["arrays"]
+    }
+    return arrays, meta
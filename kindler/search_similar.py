@@ -0,0 +1,110 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Similar books stored per book
+SIMILAR_BOOKS = int(os.getenv("SIMILAR_BOOKS", "5"))
+# Cosine similarity below which books aren't considered similar
+SIMILAR_MIN_SCORE = float(os.getenv("SIMILAR_MIN_SCORE", "0.1"))
+SIMILAR_COLUMNS = ("summary", "description")
+# Words in more books than this tell them apart no better than "the"
+SIMILAR_MAX_DOCUMENT_FREQUENCY = 0.5
+# Heaviest words of a book looked up in the others. The rest still count
+# in their similarity, but only books sharing one of these are found.
+SIMILAR_QUERY_WORDS = 20
+# Books sharing those words ranked by their full similarity, per book
+SIMILAR_CANDIDATES = 50
+# Books whose similarities are computed at once, bounding memory use
+SIMILAR_BLOCK_ROWS = 2048
+
+WORD_RE = re.compile(r"[^\W\d_]{2,}")
+
+
+def build(df, k=SIMILAR_BOOKS):
+    """Find the k books most similar to each of df's rows, by their summaries.
+
+    Returns the similar.rows array: one row per book, most similar first,
+    padded with -1 when fewer books are similar enough.
+    """
+    similar = np.full((len(df), k), -1, dtype=np.int32)
+    if not len(df) or k <= 0:
+        return {"similar.rows": similar}
+    columns = [df[column] for column in SIMILAR_COLUMNS if column in df]
+    vectors = tfidf(
+        [" ".join(texts) for texts in zip(*columns)] if columns else [""] * len(df)
+    )
+    queries = vectors.multiply(heaviest(vectors, SIMILAR_QUERY_WORDS)).tocsr()
+    vectors_t = vectors.T.tocsr()
+    for start in range(0, len(df), SIMILAR_BLOCK_ROWS):
+        block = queries[start : start + SIMILAR_BLOCK_ROWS] @ vectors_t
+        # One more, as a book is its own best candidate
+        rows, books = top_per_row(block, SIMILAR_CANDIDATES + 1)
+        rows += start
+        # Candidates found by their heaviest words, ranked by all of them
+        scores = np.asarray(vectors[rows].multiply(vectors[books]).sum(axis=1))
+        scores = scores.ravel()
+        keep = (scores >= SIMILAR_MIN_SCORE) & (rows != books)
+        candidates = sparse.csr_matrix(
+            (scores[keep], (rows[keep] - start, books[keep])), shape=block.shape
+        )
+        rows, books = top_per_row(candidates, k)
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        similar[rows + start, ranks] = books
+    return {"similar.rows": similar}
+
+
+def tfidf(texts):
+    """L2-normalized TF-IDF vectors of texts, as a sparse matrix of rows."""
+    words = pd.Series(texts, dtype=object).str.lower().str.findall(WORD_RE)
+    words = words.explode().dropna()
+    columns, vocabulary = pd.factorize(words)
+    counts = sparse.csr_matrix(
+        (np.ones(len(columns), dtype=np.float32), (words.index, columns)),
+        shape=(len(texts), len(vocabulary)),
+    )
+    counts.sum_duplicates()
+
+    documents = np.bincount(counts.indices, minlength=len(vocabulary))
+    # Words of a single book can't make two books similar
+    useful = (documents >= 2) & (
+        documents <= SIMILAR_MAX_DOCUMENT_FREQUENCY * len(texts)
+    )
+    idf = np.log((1 + len(texts)) / (1 + documents)) + 1
+    counts.data = (1 + np.log(counts.data)) * idf[counts.indices]
+    vectors = counts[:, np.flatnonzero(useful)]
+
+    norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(vectors).tocsr()
+
+
+def heaviest(vectors, n):
+    """Mask of the n largest weights of each row of vectors."""
+    rows, columns = top_per_row(vectors, n)
+    return sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=vectors.shape
+    )
+
+
+def top_per_row(matrix, n):
+    """(rows, columns) of the n largest values of each row of a CSR matrix.
+
+    Rows come in order, and their largest values first.
+    """
+    rows = []
+    columns = []
+    for row in range(matrix.shape[0]):
+        start, stop = matrix.indptr[row], matrix.indptr[row + 1]
+        values = matrix.data[start:stop]
+        top = np.arange(stop - start)
+        if len(top) > n:
+            top = np.argpartition(-values, n - 1)[:n]
+        top = top[np.argsort(-values[top], kind="stable")]
+        rows.append(np.full(len(top), row))
+        columns.append(matrix.indices[start:stop][top])
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(columns).astype(np.int64)
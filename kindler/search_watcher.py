@@ -0,0 +1,125 @@
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import redis
+
+from kindler import metrics, search_cache, search_index
+from kindler.cache import redis_client
+from kindler.search import FuzzySearcher, SEARCH_INDEX_PATH, csv_version
+
+# Seconds between checks for a new index or catalog CSV, 0 to never reload
+SEARCH_INDEX_POLL_INTERVAL = int(os.getenv("SEARCH_INDEX_POLL_INTERVAL", "60"))
+
+# Workers of a node share its files, so one of them rebuilds for all
+REBUILD_LOCK_KEY = f"search:rebuild:{socket.gethostname()}:"
+REBUILD_LOCK_TTL = 30 * 60
+REBUILD_COMMAND = (
+    "import sys; from kindler.search import rebuild_index; "
+    "rebuild_index(sys.argv[1], sys.argv[2])"
+)
+
+
+class SearchIndexWatcher:
+    """Holds the current FuzzySearcher, swapping in new index versions.
+
+    A new index written by scripts/build_search_index.py is mapped as soon as
+    it is noticed. A changed catalog CSV is first indexed in a separate
+    process, by one worker per node. Requests take .searcher once, so a swap
+    never waits for them, and the old index goes away with its last request:
+    its files are removed at the next check once no worker holds them.
+    """
+
+    def __init__(self):
+        self.searcher = None
+        self.swap(FuzzySearcher())
+        self.index_path = (
+            self.searcher.index_path
+            or SEARCH_INDEX_PATH
+            or os.path.join(os.path.dirname(self.searcher.csv_path), "search_index")
+        )
+        self.index_stamp = file_stamp(self.meta_path())
+        self.csv_stamp = file_stamp(self.searcher.csv_path)
+        if SEARCH_INDEX_POLL_INTERVAL > 0:
+            threading.Thread(
+                target=self.watch, name="search-index-watcher", daemon=True
+            ).start()
+
+    def meta_path(self):
+        return os.path.join(self.index_path, search_index.META_FILE)
+
+    def watch(self):
+        while True:
+            time.sleep(SEARCH_INDEX_POLL_INTERVAL)
+            try:
+                self.check()
+            except Exception as e:
+                logging.warning(f"Failed to check the search index for updates: {e}")
+
+    def check(self):
+        if os.path.islink(self.index_path):
+            search_index.remove_stale(self.index_path)
+        index_stamp = file_stamp(self.meta_path())
+        if index_stamp and index_stamp != self.index_stamp:
+            searcher = FuzzySearcher(self.index_path)
+            self.index_stamp = index_stamp
+            if searcher.version != self.searcher.version:
+                self.swap(searcher)
+
+        csv_path = self.searcher.csv_path
+        csv_stamp = file_stamp(csv_path)
+        if csv_stamp and csv_stamp != self.csv_stamp:
+            self.csv_stamp = csv_stamp
+            version = csv_version(csv_path)
+            if version != self.searcher.version and self.rebuild(csv_path, version):
+                self.check()
+
+    def rebuild(self, csv_path, version):
+        try:
+            if not redis_client.set(
+                REBUILD_LOCK_KEY + version, 1, nx=True, ex=REBUILD_LOCK_TTL
+            ):
+                return False
+        except redis.RedisError as e:
+            logging.warning(f"Not rebuilding the search index: {e}")
+            return False
+        logging.info(f"Rebuilding search index {version} from: {csv_path}")
+        start = time.monotonic()
+        # A separate interpreter keeps the GIL, and the memory of the build,
+        # away from the threads serving requests
+        process = subprocess.run(
+            [sys.executable, "-c", REBUILD_COMMAND, csv_path, self.index_path]
+        )
+        if process.returncode != 0:
+            logging.error(f"Search index rebuild exited with {process.returncode}")
+            metrics.incr("search_index.rebuild_failed")
+            return False
+        logging.info(
+            f"Rebuilt search index {version} in {time.monotonic() - start:.1f}s"
+        )
+        metrics.incr("search_index.rebuilt")
+        return True
+
+    def swap(self, searcher):
+        old_searcher = self.searcher
+        self.searcher = searcher
+        # loads - unloads is the number of workers serving each version
+        metrics.incr(f"search_index.loads.{searcher.version}")
+        if old_searcher is not None:
+            metrics.incr(f"search_index.unloads.{old_searcher.version}")
+            logging.info(
+                f"Swapped search index {old_searcher.version} for {searcher.version}"
+            )
+        search_cache.start_warm_up(searcher)
+
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return stat.st_mtime_ns, stat.st_size
@@ -1,8 +1,15 @@
+import codecs
+import contextlib
 import logging
+import os
+import re
+from urllib.parse import urlsplit, urlunsplit
 
 import requests
 from requests.exceptions import SSLError
 
+from kindler import http_client
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36",
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
@@ -11,50 +18,165 @@ HEADERS = {
     "DNT": "1",
 }
 
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", str(5 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+SNIFFABLE_CONTENT_TYPES = ("", "application/octet-stream", "binary/octet-stream")
+BLOB_SIGNATURES = (
+    b"%PDF",
+    b"PK\x03\x04",
+    b"\x89PNG",
+    b"GIF8",
+    b"\xff\xd8\xff",
+    b"RIFF",
+    b"OggS",
+    b"ID3",
+    b"\x1f\x8b",
+    b"\x00\x00\x00",
+)
+META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w.:-]+)""", re.IGNORECASE)
+
+
+class PageTooLargeError(requests.RequestException):
+    pass
+
 
-def is_blob_content(url):
-    verify_cert = True
+def is_blob_content(url, validators=None, max_size=MAX_PAGE_SIZE):
+    response = open_page(url, headers=validators)
     try:
-        head_resp = requests.head(
-            url, allow_redirects=True, timeout=5, verify=verify_cert
-        )
-        content_type = head_resp.headers.get("Content-Type", "").lower()
-        if content_type and not (
-            content_type.startswith("text/html")
-            or content_type.startswith("application/xhtml+xml")
-            or content_type.startswith("text/plain")
-        ):
+        response.raise_for_status()
+        if response.status_code == 304:
+            return False, {**page_validators(response), "status": 304, "text": ""}
+        chunks = response.iter_content(CHUNK_SIZE)
+        first_chunk = next(chunks, b"")
+        if is_blob(response.headers.get("Content-Type", ""), first_chunk):
+            logging.info(f"Detected blob content for {url}, aborting download")
             return True, None
+        page = read_page(response, first_chunk, chunks, max_size)
+    finally:
+        response.close()
+    return False, redirect_medium(url, page)
+
+
+@contextlib.contextmanager
+def stream_page_text(url, max_size=MAX_PAGE_SIZE):
+    """Yield (is_blob, chunks) with the page's text decoded as it downloads.
+
+    Unlike is_blob_content(), the page is never held whole in memory.
+    """
+    response = open_page(url)
+    try:
+        response.raise_for_status()
+        chunks = response.iter_content(CHUNK_SIZE)
+        first_chunk = next(chunks, b"")
+        if is_blob(response.headers.get("Content-Type", ""), first_chunk):
+            logging.info(f"Detected blob content for {url}, aborting download")
+            yield True, None
+        else:
+            yield False, iter_page_text(response, first_chunk, chunks, max_size)
+    finally:
+        response.close()
+
+
+def open_page(url, verify_cert=True, headers=None):
+    try:
+        return http_client.get(
+            url,
+            headers={**HEADERS, **(headers or {})},
+            allow_redirects=True,
+            verify=verify_cert,
+            stream=True,
+        )
     except SSLError as error:
+        if not verify_cert:
+            raise
         logging.info(
             f"Cannot get cert, trying without cert verification. Error: {error}"
         )
-        verify_cert = False
-    except requests.RequestException as error:
-        logging.info(
-            f"HEAD request failed for {url}, falling back to GET. Error: {error}"
-        )
-    req = requests.get(
-        url, headers=HEADERS, timeout=10, allow_redirects=True, verify=verify_cert
+        return open_page(url, verify_cert=False, headers=headers)
+
+
+def is_blob(content_type, first_chunk):
+    content_type = content_type.split(";")[0].strip().lower()
+    if first_chunk.startswith(BLOB_SIGNATURES):
+        return True
+    if content_type in SNIFFABLE_CONTENT_TYPES:
+        return b"\x00" in first_chunk[:1024]
+    return not content_type.startswith(TEXT_CONTENT_TYPES)
+
+
+def read_page(response, first_chunk, chunks, max_size=MAX_PAGE_SIZE):
+    return {
+        **page_validators(response),
+        "status": response.status_code,
+        "text": "".join(iter_page_text(response, first_chunk, chunks, max_size)),
+    }
+
+
+def page_validators(response):
+    return {
+        "url": response.url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def iter_page_text(response, first_chunk, chunks, max_size=MAX_PAGE_SIZE):
+    decoder = codecs.getincrementaldecoder(guess_encoding(response, first_chunk))(
+        errors="replace"
     )
-    req.raise_for_status()
-    content_type = req.headers.get("Content-Type", "").lower()
-    if not (
-        content_type.startswith("text/html")
-        or content_type.startswith("application/xhtml+xml")
-        or content_type.startswith("text/plain")
-    ):
-        return True, req
-    req = redirect_medium(url, req)
-    return False, req
-
-
-def redirect_medium(url, response):
-    if 'content="Medium"' not in response.text:
-        return response
+    content_length = response.headers.get("Content-Length", "")
+    if content_length.isdigit() and int(content_length) > max_size:
+        raise PageTooLargeError(f"Page is larger than {max_size} bytes")
+    size = 0
+    for chunk in _prepend(first_chunk, chunks):
+        size += len(chunk)
+        if size > max_size:
+            raise PageTooLargeError(f"Page is larger than {max_size} bytes")
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def guess_encoding(response, first_chunk):
+    encoding = None
+    if "charset=" in response.headers.get("Content-Type", "").lower():
+        encoding = response.encoding
+    if not encoding:
+        match = META_CHARSET_RE.search(first_chunk)
+        encoding = match.group(1).decode("ascii") if match else "utf-8"
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = "utf-8"
+    return encoding
+
+
+def _prepend(first_chunk, chunks):
+    yield first_chunk
+    yield from chunks
+
+
+def redirect_medium(url, page):
+    if 'content="Medium"' not in page["text"]:
+        return page
     try:
-        req = requests.get("https://freedium.cfd/" + url, headers=HEADERS, timeout=10)
-        req.raise_for_status()
-        return req
+        response = open_page("https://freedium.cfd/" + url)
+        try:
+            response.raise_for_status()
+            chunks = response.iter_content(CHUNK_SIZE)
+            return read_page(response, next(chunks, b""), chunks)
+        finally:
+            response.close()
     except Exception:
-        return response
+        return page
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rsplit(":", 1)[-1]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, netloc, path, parts.query, ""))
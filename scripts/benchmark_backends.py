@@ -0,0 +1,68 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from benchmark_search import percentile, sample_queries, timed  # noqa: E402
+from kindler.search import FuzzySearcher  # noqa: E402
+from kindler.search_fulltext import FULLTEXT_FILE  # noqa: E402
+
+
+def rss_mb():
+    # Resident memory of this process, pages of mapped indexes included
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the fuzzy and full-text catalog search backends."
+    )
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--query-file", help="one query per line, instead of samples")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rss = rss_mb()
+    start = time.perf_counter()
+    searcher = FuzzySearcher()
+    print(
+        f"Loaded {searcher.rows} rows in {time.perf_counter() - start:.2f}s, "
+        f"RSS +{rss_mb() - rss:.1f}MB"
+    )
+    if searcher.fulltext is None:
+        sys.exit("No full-text index, build one with scripts/build_search_index.py")
+    fulltext_size = os.path.getsize(os.path.join(searcher.index_path, FULLTEXT_FILE))
+    print(f"Full-text index: {fulltext_size / 1024 / 1024:.1f}MB")
+
+    if args.query_file:
+        with open(args.query_file, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = sample_queries(searcher, args.queries, random.Random(args.seed))
+
+    print(f"{len(queries)} queries, limit {args.limit}")
+    for name, search in (
+        ("fuzzy", searcher.search),
+        ("fulltext", searcher.search_fulltext),
+    ):
+        rss = rss_mb()
+        results, latencies = timed(lambda q: search(q, limit=args.limit), queries)
+        found = sum(len(books) for books in results) / len(queries)
+        print(
+            f"{name:>9}: mean {sum(latencies) / len(latencies) * 1000:.2f}ms, "
+            f"p50 {percentile(latencies, 0.5):.2f}ms, "
+            f"p95 {percentile(latencies, 0.95):.2f}ms, "
+            f"{found:.1f} results, RSS +{rss_mb() - rss:.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from kindler.search import FuzzySearcher  # noqa: E402
+
+
+def sample_queries(searcher, count, rng):
+    # Titles, authors and title words, some of them with a typo, the way
+    # people actually type them
+    queries = []
+    for _ in range(count):
+        row = searcher.record(rng.randrange(searcher.rows), 100)
+        kind = rng.choice(("title", "author", "words", "typo"))
+        if kind == "title":
+            query = row["title"]
+        elif kind == "author":
+            query = row["author"]
+        else:
+            words = row["title"].split() or row["author"].split()
+            query = " ".join(rng.sample(words, min(len(words), rng.randint(1, 2))))
+        if kind == "typo" and len(query) > 3:
+            i = rng.randrange(len(query) - 1)
+            query = query[:i] + query[i + 1] + query[i] + query[i + 2 :]
+        queries.append(query)
+    return queries
+
+
+def timed(search, queries):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append(time.perf_counter() - start)
+    return results, sorted(latencies)
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare prefiltered catalog search with an exhaustive scan."
+    )
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--query-file", help="one query per line, instead of samples")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    searcher = FuzzySearcher()
+    print(f"Loaded {searcher.rows} rows in {time.perf_counter() - start:.2f}s")
+
+    if args.query_file:
+        with open(args.query_file, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = sample_queries(searcher, args.queries, random.Random(args.seed))
+
+    expected, exhaustive_latencies = timed(
+        lambda q: searcher.search(q, limit=args.limit, exhaustive=True), queries
+    )
+    actual, prefiltered_latencies = timed(
+        lambda q: searcher.search(q, limit=args.limit), queries
+    )
+
+    found = total = identical = 0
+    for expected_books, actual_books in zip(expected, actual):
+        expected_urls = [book["remote_url"] for book in expected_books]
+        actual_urls = {book["remote_url"] for book in actual_books}
+        found += sum(url in actual_urls for url in expected_urls)
+        total += len(expected_urls)
+        identical += expected_books == actual_books
+
+    print(f"{len(queries)} queries, limit {args.limit}")
+    for name, latencies in (
+        ("exhaustive", exhaustive_latencies),
+        ("prefiltered", prefiltered_latencies),
+    ):
+        print(
+            f"{name:>12}: mean {sum(latencies) / len(latencies) * 1000:.2f}ms, "
+            f"p50 {percentile(latencies, 0.5):.2f}ms, "
+            f"p95 {percentile(latencies, 0.95):.2f}ms"
+        )
+    print(f"Recall: {found / total if total else 1:.4f} ({found}/{total})")
+    print(f"Identical result lists: {identical}/{len(queries)}")
+
+
+if __name__ == "__main__":
+    main()
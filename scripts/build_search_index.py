@@ -0,0 +1,33 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from kindler.search import write_index  # noqa: E402
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the memory-mapped catalog search index from the CSV."
+    )
+    parser.add_argument(
+        "--csv", default=os.path.join(SCRIPTS_DIR, "index_with_summary.csv")
+    )
+    parser.add_argument("--output", default=os.path.join(SCRIPTS_DIR, "search_index"))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    arrays, meta = write_index(args.csv, args.output)
+    size = sum(array.nbytes for array in arrays.values())
+    print(
+        f"Indexed {meta['rows']} rows ({size / 1024 / 1024:.1f} MB) as version "
+        f"{meta['version']} in {time.perf_counter() - start:.1f}s: {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+from bs4 import BeautifulSoup, NavigableString
+
+from kindler import gutenberg_au_cleaner
+from kindler.gutenberg_au_cleaner import GutenbergAuCleaner, remove_excessive_elements
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "gutenberg_au")
+URL = "http://gutenberg.net.au/ebooks/b.html"
+BOOKS = ["plain", "center", "nested", "footer", "h3"]
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def normalize(html_content):
+    # Whitespace-only strings are the one documented difference with the
+    # BeautifulSoup cleaner the expected outputs come from
+    soup = BeautifulSoup(html_content, "html.parser")
+    for string in soup.find_all(string=True):
+        if type(string) is NavigableString and not string.strip():
+            string.extract()
+    return str(soup)
+
+
+@pytest.fixture(autouse=True)
+def fake_fetch_images(monkeypatch):
+    monkeypatch.setattr(
+        gutenberg_au_cleaner,
+        "fetch_images",
+        lambda downloads: [
+            None if "missing" in img_url else local_path
+            for img_url, local_path in downloads
+        ],
+    )
+
+
+@pytest.mark.parametrize("book", BOOKS)
+def test_clean_for_reading(book):
+    content, cover, title = remove_excessive_elements(
+        read_fixture(f"{book}.html"), URL, None
+    )
+    assert normalize(content) == normalize(read_fixture(f"{book}.expected.html"))
+    assert cover is None
+    assert title
+
+
+@pytest.mark.parametrize("book", BOOKS)
+def test_clean_for_ebook(book, tmp_path):
+    content, _, _ = remove_excessive_elements(
+        read_fixture(f"{book}.html"), URL, str(tmp_path)
+    )
+    assert normalize(content) == normalize(read_fixture(f"{book}.ebook.html"))
+
+
+@pytest.mark.parametrize("book", BOOKS)
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_clean_chunks(book, chunk_size):
+    html_content = read_fixture(f"{book}.html")
+    chunks = (
+        html_content[i : i + chunk_size]
+        for i in range(0, len(html_content), chunk_size)
+    )
+    assert GutenbergAuCleaner(URL).clean(chunks) == GutenbergAuCleaner(URL).clean(
+        html_content
+    )
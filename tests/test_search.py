@@ -0,0 +1,69 @@
+import csv
+
+import pytest
+
+from kindler.search import FuzzySearcher, write_index
+
+COLUMNS = [
+    "author",
+    "title",
+    "location",
+    "relative_location",
+    "remote_url",
+    "image_relative_location",
+    "image_remote_location",
+    "image_google_book",
+    "description",
+    "summary",
+]
+
+
+def book(i, title, summary):
+    return {
+        "author": f"Author {i}",
+        "title": title,
+        "location": f"/x/ebooks/{i}.html",
+        "relative_location": f"ebooks/{i}.html",
+        "remote_url": f"http://gutenberg.net.au/ebooks/{i}.html",
+        "image_relative_location": "",
+        "image_remote_location": "",
+        "image_google_book": "",
+        "description": "",
+        "summary": summary,
+    }
+
+
+@pytest.fixture(scope="module")
+def searcher(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("catalog")
+    # More books match "garden" by title than fit in a page
+    books = [
+        book(i, f"Garden Tales {i}", "A story of ships and sailors.") for i in range(30)
+    ]
+    books.append(book(30, "The Lost Key", "Hidden somewhere in a walled garden."))
+    books.append(book(31, "Garden of Roses", "Roses bloom in the garden all summer."))
+    csv_path = directory / "index_with_summary.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(books)
+    index_path = directory / "search_index"
+    write_index(str(csv_path), str(index_path))
+    return FuzzySearcher(str(index_path))
+
+
+def test_summary_only_match_is_reachable(searcher):
+    titles = [result["title"] for result in searcher.search_fulltext("garden", 10)]
+    assert "The Lost Key" in titles
+    assert len(titles) == 10
+
+
+def test_title_and_summary_match_ranks_first(searcher):
+    results = searcher.search_fulltext("garden", 50)
+    assert results[0]["title"] == "Garden of Roses"
+    assert results[0]["score"] > results[1]["score"]
+
+
+def test_fuzzy_search_ignores_summaries(searcher):
+    titles = [result["title"] for result in searcher.search("garden", 50)]
+    assert "The Lost Key" not in titles
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from kindler.api.web import clean_readability_html
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "web")
+URL = "https://example.com/blog/post.html"
+QUERY = "tomato pots&more"
+PAGES = ["blog", "blog.summary", "news", "news.summary", "docs"]
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+# Expected outputs come from the cleaner that ran one pass per rule
+@pytest.mark.parametrize("page", PAGES)
+def test_clean(page):
+    content = clean_readability_html(read_fixture(f"{page}.html"), URL, QUERY)
+    assert content == read_fixture(f"{page}.expected.html").rstrip("\n")
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_clean_links_only(page):
+    content = clean_readability_html(read_fixture(f"{page}.html"), URL, QUERY, True)
+    assert content == read_fixture(f"{page}.links.html").rstrip("\n")